@@ -1,10 +1,15 @@
 # app.py - COMPREHENSIVE AI FITNESS PLATFORM
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, g, Response
 from flask_cors import CORS
 import base64, cv2, numpy as np
 import os, json, random, datetime, math, time
-from collections import defaultdict
-import statistics
+import threading, multiprocessing, atexit, zlib, bisect, sqlite3
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from itertools import chain
+from multiprocessing import shared_memory
+import statistics, hashlib, tempfile, csv, heapq
 
 # Mediapipe import
 try:
@@ -13,47 +18,1246 @@ except ImportError:
     mp = None
     print("⚠ Install mediapipe: pip install mediapipe")
 
+# Cross-process locks for shared rep state (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# WebSocket support for frame streaming
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+    print("⚠ Install flask-sock for frame streaming: pip install flask-sock")
+
 app = Flask(__name__)
 CORS(app)
 app.secret_key = 'ai_fitness_super_secret_key_2024'
-
-POSE = None
-if mp:
-    POSE = mp.solutions.pose.Pose()
+sock = Sock(app) if Sock else None
 
 # ===== GLOBAL DATA STORES =====
-CLIENTS = {}
-USER_DATA = defaultdict(lambda: {
-    "workout_history": [],
-    "diet_preferences": {},
-    "emotional_state": [],
-    "performance_scores": [],
-    "workout_skip_probability": 0.3,
-    "last_activity": None,
-    "gym_preferences": {}
-})
+CLIENT_CACHE_SIZE = int(os.environ.get("CLIENT_CACHE_SIZE", 10000))
+CLIENT_IDLE_TTL = float(os.environ.get("CLIENT_IDLE_TTL", 3600))
+
+class ClientStateCache(OrderedDict):
+    """Per-client state held in memory for at most `max_size` clients.
+
+    `cache[client_id]` returns the client's entry, creating it with
+    `factory()` and filling it from the state store via
+    `restore(client_id, value)` on a miss. The least recently used entry
+    is evicted past `max_size`, as is any entry idle for more than `ttl`
+    seconds; `spill(client_id, value)` saves what the store doesn't
+    already have before the entry is dropped. lookup() is the read-only
+    path: a client with no saved state gets None and nothing is allocated.
+    """
+    
+    def __init__(self, factory, restore=None, spill=None, max_size=CLIENT_CACHE_SIZE, ttl=CLIENT_IDLE_TTL):
+        super().__init__()
+        self.factory = factory
+        self.restore = restore
+        self.spill = spill
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._touched = {}
+        self._lock = threading.RLock()
+    
+    def __getitem__(self, client_id):
+        value = self._get(client_id)
+        if value is None:
+            value = self._load(client_id, insert_empty=True)
+        return value
+    
+    def __setitem__(self, client_id, value):
+        with self._lock:
+            super().__setitem__(client_id, value)
+            self._touch(client_id)
+            self._evict()
+    
+    def __delitem__(self, client_id):
+        with self._lock:
+            super().__delitem__(client_id)
+            del self._touched[client_id]
+    
+    def lookup(self, client_id):
+        """The client's entry if it is cached or has saved state, else None"""
+        value = self._get(client_id)
+        if value is None:
+            value = self._load(client_id, insert_empty=False)
+        return value
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0
+        }
+    
+    def _get(self, client_id):
+        with self._lock:
+            self._evict()
+            if not super().__contains__(client_id):
+                return None
+            self.hits += 1
+            self._touch(client_id)
+            return super().__getitem__(client_id)
+    
+    def _load(self, client_id, insert_empty):
+        self.misses += 1
+        value = self.factory()
+        found = self.restore(client_id, value) if self.restore else False
+        if not (found or insert_empty):
+            return None
+        with self._lock:
+            if super().__contains__(client_id):
+                return super().__getitem__(client_id)  # another thread loaded it first
+            self[client_id] = value
+            return value
+    
+    def _touch(self, client_id):
+        self.move_to_end(client_id)
+        self._touched[client_id] = time.monotonic()
+    
+    def _evict(self):
+        # Caller holds self._lock
+        cutoff = time.monotonic() - self.ttl
+        while self and (len(self) > self.max_size or self._touched[next(iter(self))] < cutoff):
+            client_id, value = self.popitem(last=False)
+            del self._touched[client_id]
+            self.evictions += 1
+            if self.spill:
+                self.spill(client_id, value)
+
+def new_user_data():
+    return {
+        "workout_history": [],  # logged workouts (habit tracker); append with record_workout
+        "workout_index": WorkoutIndex(),
+        "rep_history": RingBuffer(REP_HISTORY_DTYPE, REP_HISTORY_SIZE),
+        "diet_preferences": {},
+        "emotional_state": [],
+        "performance_scores": ScoreStats(SCORE_HISTORY_SIZE),
+        "workout_skip_probability": 0.3,
+        "last_activity": None,
+        "gym_preferences": {}
+    }
+
+CLIENT_LOCK_STRIPES = int(os.environ.get("CLIENT_LOCK_STRIPES", 256))
+
+class ClientLocks:
+    """Lock table sharded by client_id hash.
+
+    Request threads hold their client's lock while they mutate that
+    client's state, so two in-flight frames from one client can't lose
+    updates, while clients on other stripes run in parallel. The locks are
+    reentrant so a route holding one can call helpers that take it again.
+    """
+    
+    def __init__(self, stripes=CLIENT_LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+    
+    def stripe(self, client_id):
+        return zlib.crc32(str(client_id).encode()) % len(self._locks)
+    
+    def __call__(self, client_id):
+        return self._locks[self.stripe(client_id)]
+
+client_lock = ClientLocks()
+
+# Entries are loaded from and spilled to the state store; see STATE STORE
+CLIENTS = ClientStateCache(lambda: ClientSession(),
+                           restore=lambda client_id, session: restore_session(client_id, session),
+                           spill=lambda client_id, session: spill_session(client_id, session))
+USER_DATA = ClientStateCache(new_user_data,
+                             restore=lambda client_id, data: restore_user_data(client_id, data),
+                             spill=lambda client_id, data: spill_user_data(client_id, data))
+
+# ===== HISTORY BUFFERS =====
+REP_HISTORY_SIZE = 100
+SCORE_HISTORY_SIZE = 50
+WORKOUT_HOUR_WINDOW = 10  # workouts behind the most common workout hour
+REP_HISTORY_DTYPE = np.dtype([
+    ("timestamp", np.float64),  # epoch seconds
+    ("exercise", np.uint8),     # index into ENABLED_EXERCISES
+    ("knee_angle", np.float32),
+    ("symmetry", np.float32),
+    ("rom", np.float32),
+    ("score", np.uint8)
+])
+
+class RingBuffer:
+    """Fixed-capacity typed history with O(1) append and zero-copy reads.
+
+    Each row is written twice, at `i` and `i + capacity`, so the newest
+    n rows are always one contiguous slice of the backing array and
+    view() never copies.
+    """
+    __slots__ = ("capacity", "_data", "_next", "_len")
+    
+    def __init__(self, dtype, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=dtype)
+        self._next = 0
+        self._len = 0
+    
+    def __len__(self):
+        return self._len
+    
+    def append(self, row):
+        i = self._next
+        self._data[i] = self._data[i + self.capacity] = row
+        self._next = (i + 1) % self.capacity
+        self._len = min(self._len + 1, self.capacity)
+    
+    def view(self, n=None):
+        """Read-only array of the newest n rows (all by default), oldest first"""
+        n = self._len if n is None else min(n, self._len)
+        end = self._next + self.capacity
+        out = self._data[end - n:end]
+        out.flags.writeable = False
+        return out
+
+class ScoreStats:
+    """Performance score history with running aggregates.
+
+    Keeps the sums behind the trend (last RECENT scores vs the ones before
+    them), the whole-window sum and a monotonic deque for the best score,
+    each updated in O(1) per score, so the trend and performance endpoints
+    never rescan the history.
+    """
+    RECENT = 7
+    __slots__ = ("scores", "seen", "window_sum", "recent_sum", "head_sum", "_best")
+    
+    def __init__(self, capacity):
+        self.scores = RingBuffer(np.uint8, capacity)
+        self.seen = 0
+        self.window_sum = 0
+        self.recent_sum = 0
+        self.head_sum = 0  # first n // 2 scores: the baseline until RECENT * 2 exist
+        self._best = deque()  # (sequence number, score), scores decreasing
+    
+    def __len__(self):
+        return len(self.scores)
+    
+    def view(self, n=None):
+        return self.scores.view(n)
+    
+    def append(self, score):
+        score = int(score)
+        scores = self.scores
+        n = len(scores)
+        if n == scores.capacity:
+            self.window_sum -= int(scores.view(n)[0])
+        if n >= self.RECENT:
+            self.recent_sum -= int(scores.view(self.RECENT)[0])
+        scores.append(score)
+        self.window_sum += score
+        self.recent_sum += score
+        n += n < scores.capacity
+        if n < 2 * self.RECENT and n % 2 == 0:
+            self.head_sum += int(scores.view()[n // 2 - 1])
+        
+        best = self._best
+        while best and best[-1][1] <= score:
+            best.pop()
+        best.append((self.seen, score))
+        self.seen += 1
+        if best[0][0] < self.seen - scores.capacity:
+            best.popleft()
+    
+    @property
+    def best(self):
+        return self._best[0][1] if self._best else 0
+    
+    def averages(self):
+        """(recent average, baseline average), split like calculate_weekly_trend"""
+        n = len(self.scores)
+        if n == 0:
+            return 0, 0
+        avg_recent = self.recent_sum / min(n, self.RECENT)
+        if n >= 2 * self.RECENT:
+            avg_older = (self.window_sum - self.recent_sum) / (n - self.RECENT)
+        elif self.seen > n:
+            # Window shorter than 2 * RECENT has wrapped: at most RECENT scores to add
+            avg_older = float(np.mean(self.scores.view()[:n // 2]))
+        else:
+            avg_older = self.head_sum / (n // 2) if n >= 2 else 0
+        return avg_recent, avg_older
+    
+    def trend(self):
+        if len(self.scores) < 2:
+            return "No trend data yet"
+        return weekly_trend_label(*self.averages())
+
+def workout_calories(workout):
+    # MET value * duration in hours * weight in kg (assuming 70kg); only squats are estimated
+    if workout["type"] == "squat":
+        return 5 * (workout["duration"] / 60) * 70
+    return 0
+
+class WorkoutIndex:
+    """Logged workouts bucketed by day, maintained on append.
+
+    Each day (as a date ordinal) maps to [workouts, minutes, calories], and
+    an hour-of-day histogram covers the last WORKOUT_HOUR_WINDOW workouts.
+    Timestamps are parsed once, when a workout is added, so the dashboard,
+    streak and habit queries cost O(days in range) whatever the history
+    length.
+    """
+    __slots__ = ("days", "buckets", "hours", "_recent_hours")
+    
+    def __init__(self):
+        self.days = []  # sorted day ordinals with at least one workout
+        self.buckets = {}  # day ordinal -> [count, duration, calories]
+        self.hours = np.zeros(24, dtype=np.int32)
+        self._recent_hours = deque()
+    
+    def __len__(self):
+        return len(self.days)
+    
+    def add(self, workout):
+        dt = datetime.datetime.fromisoformat(workout["timestamp"])
+        day = dt.toordinal()
+        bucket = self.buckets.get(day)
+        if bucket is None:
+            bucket = self.buckets[day] = [0, 0, 0.0]
+            if self.days and day < self.days[-1]:
+                bisect.insort(self.days, day)
+            else:
+                self.days.append(day)
+        bucket[0] += 1
+        bucket[1] += workout["duration"]
+        bucket[2] += workout_calories(workout)
+        
+        if len(self._recent_hours) == WORKOUT_HOUR_WINDOW:
+            self.hours[self._recent_hours.popleft()] -= 1
+        self._recent_hours.append(dt.hour)
+        self.hours[dt.hour] += 1
+    
+    def totals_since(self, first_day):
+        """[workouts, minutes, calories] over days >= first_day"""
+        totals = [0, 0, 0.0]
+        for day in self.days[bisect.bisect_left(self.days, first_day):]:
+            for i, value in enumerate(self.buckets[day]):
+                totals[i] += value
+        return totals
+    
+    def streak(self, today):
+        """Consecutive workout days ending today or yesterday"""
+        days = self.days
+        if not days or today - days[-1] > 1:
+            return 0
+        streak = 1
+        while streak < len(days) and days[-streak] - days[-streak - 1] == 1:
+            streak += 1
+        return streak
+    
+    def common_hour(self, default=18):
+        """Most frequent hour among the recent workouts (earliest on ties)"""
+        return int(np.argmax(self.hours)) if self._recent_hours else default
+
+def record_workout(user_data, workout):
+    user_data["workout_history"].append(workout)
+    user_data["workout_index"].add(workout)
+
+EMPTY_USER_DATA = new_user_data()  # read-only stand-in for clients with no saved state
+
+# ===== STATE STORE (durable user state) =====
+STATE_STORE = os.environ.get("STATE_STORE", "sqlite")  # "sqlite" or "memory"
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "fitness_state.db")
+STORE_FLUSH_INTERVAL = float(os.environ.get("STORE_FLUSH_INTERVAL", 1.0))
+STORE_BATCH_SIZE = int(os.environ.get("STORE_BATCH_SIZE", 500))
+CHAT_HISTORY_SIZE = 20
+# Records reloaded per kind on first access (None = all)
+EVENT_LIMITS = {"workout": None, "rep": REP_HISTORY_SIZE, "emotion": None, "chat": CHAT_HISTORY_SIZE}
+
+class MemoryStore:
+    """State store interface; keeps nothing, so state lasts as long as the process.
+
+    append() records an event (workout, rep, emotion, chat message) and
+    put() replaces a per-client value (preferences, rep counters). Both
+    are called from the frame path and must not block on I/O.
+    """
+    durable = False  # True if state outlives the process
+    
+    def append(self, client_id, kind, record):
+        pass
+    
+    def put(self, client_id, key, value):
+        pass
+    
+    def load(self, client_id):
+        """{"events": {kind: [record, ...] oldest first}, "values": {key: value}}"""
+        return {"events": {}, "values": {}}
+    
+    def get(self, client_id, key):
+        return None
+    
+    def scan(self, kind, fields):
+        """(client_id, *fields) for every saved `kind` event, each client's
+        rows together and oldest first; fields are JSON paths like "$.timestamp"
+        """
+        return []
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def stats(self):
+        return {"backend": "memory"}
+
+class SQLiteStore(MemoryStore):
+    """SQLite (WAL) store with write-behind batching.
+
+    append() and put() only push onto an in-memory queue. A background
+    thread drains it in one transaction every STORE_FLUSH_INTERVAL
+    seconds, or sooner once STORE_BATCH_SIZE writes are waiting. Reads
+    use one connection per thread, which WAL lets run alongside the writer.
+    """
+    durable = True
+    
+    def __init__(self, path, flush_interval=STORE_FLUSH_INTERVAL, batch_size=STORE_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.flushed = 0
+        self._pending = deque()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._local = threading.local()
+        
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                ts REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_client ON events (client_id, kind, id);
+            CREATE TABLE IF NOT EXISTS client_values (
+                client_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (client_id, key)
+            );
+        """)
+        self._thread = threading.Thread(target=self._run, name="state-store", daemon=True)
+        self._thread.start()
+    
+    def append(self, client_id, kind, record):
+        # JSON encoding happens on the flush thread
+        self._pending.append((client_id, kind, time.time(), record))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+    
+    def put(self, client_id, key, value):
+        self._pending.append((client_id, key, None, value))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+    
+    def load(self, client_id):
+        if self._pending:
+            self.flush()  # this client may still have queued writes
+        conn = self._reader()
+        events = {}
+        for kind, limit in EVENT_LIMITS.items():
+            rows = conn.execute(
+                "SELECT data FROM events WHERE client_id = ? AND kind = ? ORDER BY id DESC LIMIT ?",
+                (client_id, kind, -1 if limit is None else limit)).fetchall()
+            if rows:
+                events[kind] = [json.loads(data) for (data,) in reversed(rows)]
+        values = {key: json.loads(data) for key, data in conn.execute(
+            "SELECT key, data FROM client_values WHERE client_id = ?", (client_id,))}
+        return {"events": events, "values": values}
+    
+    def get(self, client_id, key):
+        if self._pending:
+            self.flush()
+        row = self._reader().execute(
+            "SELECT data FROM client_values WHERE client_id = ? AND key = ?", (client_id, key)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def scan(self, kind, fields):
+        self.flush()
+        # Fields are pulled out in SQL so bulk reads never decode JSON in Python
+        columns = "".join(", json_extract(data, ?)" for _ in fields)
+        return self._reader().execute(
+            f"SELECT client_id{columns} FROM events WHERE kind = ? ORDER BY client_id, id",
+            (*fields, kind)).fetchall()
+    
+    def flush(self):
+        with self._flush_lock:
+            batch = []
+            while self._pending:
+                batch.append(self._pending.popleft())
+            if not batch:
+                return
+            events = [(cid, kind, ts, json.dumps(record)) for cid, kind, ts, record in batch if ts is not None]
+            # Values: last write per key wins
+            values = {(cid, key): value for cid, key, ts, value in batch if ts is None}
+            with self._writer:
+                self._writer.executemany(
+                    "INSERT INTO events (client_id, kind, ts, data) VALUES (?, ?, ?, ?)", events)
+                self._writer.executemany(
+                    "INSERT OR REPLACE INTO client_values (client_id, key, data) VALUES (?, ?, ?)",
+                    [(cid, key, json.dumps(value)) for (cid, key), value in values.items()])
+            self.flushed += len(batch)
+    
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        self._writer.close()
+    
+    def stats(self):
+        return {"backend": "sqlite", "path": self.path, "pending": len(self._pending), "flushed": self.flushed}
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+    
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"⚠ State store flush failed: {e}")
+
+_STATE_STORE = None
+_STATE_STORE_LOCK = threading.Lock()
+
+def get_state_store():
+    """The process-wide state store, opened on first use"""
+    global _STATE_STORE
+    if _STATE_STORE is None:
+        with _STATE_STORE_LOCK:
+            if _STATE_STORE is None:
+                if STATE_STORE == "sqlite":
+                    store = SQLiteStore(STATE_DB_PATH)
+                    atexit.register(store.close)
+                else:
+                    store = MemoryStore()
+                _STATE_STORE = store
+    return _STATE_STORE
+
+def restore_user_data(client_id, data):
+    """Fill a new USER_DATA entry from the state store; False if nothing was saved"""
+    saved = get_state_store().load(client_id)
+    events, values = saved["events"], saved["values"]
+    if not events and not values:
+        return False
+    for workout in events.get("workout", []):
+        record_workout(data, workout)
+    data["emotional_state"].extend(tuple(e) for e in events.get("emotion", []))
+    for rep in events.get("rep", []):
+        i = EXERCISE_INDEX.get(rep["exercise"])
+        if i is not None:
+            data["rep_history"].append(
+                (rep["timestamp"], i, rep["knee_angle"], rep["symmetry"], rep["rom"], rep["score"]))
+    for key in ("diet_preferences", "gym_preferences"):
+        if key in values:
+            data[key] = values[key]
+    for score in values.get("performance_scores", []):
+        data["performance_scores"].append(score)
+    return True
+
+def spill_user_data(client_id, data):
+    # Everything else is written through as it changes; scores are per frame and only saved here
+    if len(data["performance_scores"]):
+        get_state_store().put(client_id, "performance_scores", data["performance_scores"].view().tolist())
+
+def restore_chat_history(client_id, history):
+    history.extend(get_state_store().load(client_id)["events"].get("chat", []))
+    return bool(history)
+
+def restore_rep_state(client_id, state):
+    saved = get_state_store().get(client_id, "rep_state") or {}
+    for name, (stage, reps, min_angle, max_angle) in saved.items():
+        i = EXERCISE_INDEX.get(name)
+        if i is not None and stage in STAGE_INDEX:
+            state[i] = (STAGE_INDEX[stage], reps, min_angle, max_angle)
+    return state
+
+def rep_state_record(state):
+    # Keyed by exercise name so the counters survive a change of ENABLED_EXERCISES
+    return {
+        name: [STAGES[stage], reps, min_angle, max_angle]
+        for name, (stage, reps, min_angle, max_angle) in zip(ENABLED_EXERCISES, state.tolist())
+    }
+
+def restore_session(client_id, session):
+    if get_shared_rep_state() is None:
+        restore_rep_state(client_id, session.reps)
+    return True
+
+def spill_session(client_id, session):
+    # With shared rep state the counters live in the segment and save_rep keeps
+    # the store current; session.reps is unused then and would roll reps back
+    if get_shared_rep_state() is None:
+        get_state_store().put(client_id, "rep_state", rep_state_record(session.reps))
+
+def save_rep(client_id, exercise, state, rep_row):
+    """Queue a completed rep and the client's rep counters for the store"""
+    timestamp, _, knee_angle, symmetry, rom, score = rep_row
+    store = get_state_store()
+    store.append(client_id, "rep", {
+        "timestamp": timestamp,
+        "exercise": exercise,
+        "knee_angle": round(knee_angle, 1),
+        "symmetry": symmetry,
+        "rom": rom,
+        "score": score
+    })
+    store.put(client_id, "rep_state", rep_state_record(state))
+
+# ===== METRICS =====
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """Fixed-bucket latency histogram (seconds), Prometheus style.
+
+    observe() is a bisect and three additions under a lock, so timing
+    can stay on for every frame.
+    """
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+    
+    def snapshot(self):
+        """(cumulative counts per upper bound, sum, count)"""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative, running = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            running += n
+            cumulative.append((bound, running))
+        return cumulative, total, count
+
+STAGE_LATENCY = defaultdict(Histogram)  # stage -> Histogram
+ROUTE_LATENCY = defaultdict(Histogram)  # (route, method) -> Histogram
+ROUTE_STATUS = defaultdict(int)         # (route, method, status) -> requests
+
+class timed:
+    """`with timed("stage"):` records the block's wall time in STAGE_LATENCY"""
+    __slots__ = ("histogram", "start")
+    
+    def __init__(self, stage):
+        self.histogram = STAGE_LATENCY[stage]
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+@app.before_request
+def _start_route_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_route_latency(response):
+    rule = request.url_rule
+    start = g.get("request_start")
+    if rule is not None and start is not None and rule.rule.startswith("/api/"):
+        # Label by route pattern, not raw path, to keep label cardinality fixed
+        ROUTE_LATENCY[(rule.rule, request.method)].observe(time.perf_counter() - start)
+        ROUTE_STATUS[(rule.rule, request.method, response.status_code)] += 1
+    return response
+
+def _prom_labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+
+def _prom_histogram(lines, name, help_text, histograms, label_names):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+        cumulative, total, count = histogram.snapshot()
+        for bound, n in cumulative:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_prom_labels(**labels, le=le)} {n}")
+        lines.append(f"{name}_sum{_prom_labels(**labels)} {total:.6f}")
+        lines.append(f"{name}_count{_prom_labels(**labels)} {count}")
+
+def _prom_metric(lines, name, kind, help_text, samples):
+    """samples: iterable of (labels dict, value)"""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{_prom_labels(**labels)} {value}")
+
+# ===== POSE ESTIMATOR POOL =====
+POSE_POOL_SIZE = int(os.environ.get("POSE_POOL_SIZE", os.cpu_count() or 1))
+POSE_IDLE_TIMEOUT = float(os.environ.get("POSE_IDLE_TIMEOUT", 60))
+
+class PosePool:
+    """Per-client pose estimators with sticky affinity.
+
+    MediaPipe Pose tracks the person from frame to frame, so every active
+    client keeps its own estimator for as long as it keeps sending frames.
+    At most `size` estimators exist; estimators of clients idle for longer
+    than `idle_timeout` seconds are reset and handed to new clients. When
+    every estimator is assigned, the least recently used idle one is taken
+    over, and callers wait only if all of them are mid-frame.
+
+    A lease yields the client's slot: its estimator under "pose" plus the
+    crop window ("roi") that tracks the athlete between frames.
+    """
+    
+    def __init__(self, factory, size=POSE_POOL_SIZE, idle_timeout=POSE_IDLE_TIMEOUT):
+        self.size = max(1, size)
+        self.idle_timeout = idle_timeout
+        self._factory = factory
+        self._cond = threading.Condition()
+        self._assigned = {}  # client_id -> {"pose", "roi", "last_used", "busy"}
+        self._free = []
+        self._created = 0
+        self.reclaimed = 0
+        self.roi_frames = 0
+        self.full_frames = 0
+    
+    def acquire(self, client_id):
+        with self._cond:
+            while True:
+                slot = self._assigned.get(client_id)
+                if slot is not None:
+                    # One frame per client at a time keeps tracking in order
+                    if not slot["busy"]:
+                        break
+                else:
+                    pose = self._take_estimator()
+                    if pose is not None:
+                        slot = {"pose": pose, "roi": None, "last_used": 0.0, "busy": False}
+                        self._assigned[client_id] = slot
+                        break
+                self._cond.wait()
+            
+            slot["busy"] = True
+            slot["last_used"] = time.monotonic()
+            return slot
+    
+    def release(self, client_id):
+        with self._cond:
+            slot = self._assigned.get(client_id)
+            if slot is not None:
+                slot["busy"] = False
+                slot["last_used"] = time.monotonic()
+            self._cond.notify_all()
+    
+    @contextmanager
+    def lease(self, client_id):
+        slot = self.acquire(client_id)
+        try:
+            yield slot
+        finally:
+            self.release(client_id)
+    
+    def reclaim_idle(self):
+        with self._cond:
+            self._reclaim_idle(time.monotonic() - self.idle_timeout)
+    
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "assigned": len(self._assigned),
+                "busy": sum(1 for slot in self._assigned.values() if slot["busy"]),
+                "free": len(self._free),
+                "reclaimed": self.reclaimed,
+                "roi_frames": self.roi_frames,
+                "full_frames": self.full_frames
+            }
+    
+    def _take_estimator(self):
+        # Caller holds self._cond
+        self._reclaim_idle(time.monotonic() - self.idle_timeout)
+        if self._free:
+            return self._free.pop()
+        if self._created < self.size:
+            self._created += 1
+            return self._factory()
+        
+        idle = [(slot["last_used"], cid) for cid, slot in self._assigned.items() if not slot["busy"]]
+        if not idle:
+            return None
+        _, victim = min(idle)
+        self._reclaim(victim)
+        return self._free.pop()
+    
+    def _reclaim_idle(self, cutoff):
+        expired = [cid for cid, slot in self._assigned.items()
+                   if not slot["busy"] and slot["last_used"] < cutoff]
+        for cid in expired:
+            self._reclaim(cid)
+    
+    def _reclaim(self, client_id):
+        pose = self._assigned.pop(client_id)["pose"]
+        pose.reset()
+        self._free.append(pose)
+        self.reclaimed += 1
+
+_POSE_POOL = None
+_POSE_POOL_PID = None
+_POSE_POOL_LOCK = threading.Lock()
+
+def get_pose_pool():
+    """Pose pool for the current process.
+
+    Built lazily and rebuilt after a fork: MediaPipe graphs own threads and
+    cannot be shared with a forked child (gunicorn --preload workers,
+    multiprocessing workers), so each process gets its own pool.
+    """
+    global _POSE_POOL, _POSE_POOL_PID
+    if mp is None:
+        return None
+    pid = os.getpid()
+    if _POSE_POOL_PID != pid:
+        with _POSE_POOL_LOCK:
+            if _POSE_POOL_PID != pid:
+                _POSE_POOL = PosePool(mp.solutions.pose.Pose)
+                _POSE_POOL_PID = pid
+    return _POSE_POOL
+
+# ===== ROI TRACKING =====
+ROI_MARGIN = float(os.environ.get("ROI_MARGIN", 0.25))
+ROI_MAX_SIDE = int(os.environ.get("ROI_MAX_SIDE", 320))
+ROI_MIN_VISIBILITY = 0.3
+ROI_MAX_COVERAGE = 0.8  # crops bigger than this share of the frame aren't worth it
+
+def roi_from_landmarks(landmarks, w, h, current=None, margin=ROI_MARGIN):
+    """Pixel crop (x0, y0, x1, y1) around the visible landmarks, or None.
+
+    The box is grown by `margin` of its size on every side so the athlete
+    stays inside it while moving. The current crop is kept while it still
+    contains the body; a crop that keeps moving shifts MediaPipe's
+    coordinate frame and hurts its landmark smoothing.
+    """
+    visible = landmarks[landmarks[:, 3] > ROI_MIN_VISIBILITY, :2]
+    if len(visible) < 4:
+        return None
+    
+    lo = np.clip(visible.min(axis=0), 0, 1)
+    hi = np.clip(visible.max(axis=0), 0, 1)
+    x0, y0 = int(lo[0] * w), int(lo[1] * h)
+    x1, y1 = int(math.ceil(hi[0] * w)), int(math.ceil(hi[1] * h))
+    
+    if current is not None:
+        cx0, cy0, cx1, cy1 = current
+        if cx0 <= x0 and cy0 <= y0 and x1 <= cx1 and y1 <= cy1:
+            return current
+    
+    mx = int((x1 - x0) * margin)
+    my = int((y1 - y0) * margin)
+    roi = (max(0, x0 - mx), max(0, y0 - my), min(w, x1 + mx), min(h, y1 + my))
+    if (roi[2] - roi[0]) * (roi[3] - roi[1]) > ROI_MAX_COVERAGE * w * h:
+        return None
+    return roi
+
+def run_pose(pose, img, roi=None):
+    """Pose on the whole BGR frame or on a downsized crop of it.
+
+    Landmarks from a crop are mapped back to full-frame normalized
+    coordinates, so callers never see the difference.
+    """
+    if roi is None:
+        view = img
+    else:
+        x0, y0, x1, y1 = roi
+        view = img[y0:y1, x0:x1]
+        scale = ROI_MAX_SIDE / max(view.shape[:2])
+        if scale < 1:
+            view = cv2.resize(view, (max(1, int(view.shape[1] * scale)), max(1, int(view.shape[0] * scale))),
+                              interpolation=cv2.INTER_AREA)
+    
+    res = pose.process(cv2.cvtColor(view, cv2.COLOR_BGR2RGB))
+    if not res.pose_landmarks:
+        return None
+    landmarks = landmarks_to_array(res.pose_landmarks)
+    
+    if roi is not None:
+        h, w = img.shape[:2]
+        cw, ch = x1 - x0, y1 - y0
+        landmarks[:, 0] = (landmarks[:, 0] * cw + x0) / w
+        landmarks[:, 1] = (landmarks[:, 1] * ch + y0) / h
+        landmarks[:, 2] *= cw / w
+    return landmarks
+
+def detect_landmarks(img, client_id):
+    """Run pose on a BGR frame in this process; (33, 4) landmark array or None"""
+    h, w = img.shape[:2]
+    pose_pool = get_pose_pool()
+    with pose_pool.lease(client_id) as slot:
+        landmarks = None
+        if slot["roi"] is not None:
+            landmarks = run_pose(slot["pose"], img, slot["roi"])
+            pose_pool.roi_frames += 1
+        if landmarks is None:
+            # First frame or tracking lost: full-frame detection
+            landmarks = run_pose(slot["pose"], img)
+            pose_pool.full_frames += 1
+        slot["roi"] = None if landmarks is None else roi_from_landmarks(landmarks, w, h, slot["roi"])
+    return landmarks
+
+# ===== INFERENCE SERVICE (worker processes) =====
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+INFERENCE_MAX_PENDING = int(os.environ.get("INFERENCE_MAX_PENDING", 2))
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", 5))
+MAX_FRAME_BYTES = 1920 * 1080 * 3
+LANDMARK_COUNT = 33
+LANDMARK_BYTES = LANDMARK_COUNT * 4 * 4  # x, y, z, visibility as float32
+DEFAULT_FRAME_SIZE = (640, 480)
+
+class FrameDropped(Exception):
+    """A newer frame from the same client pushed this one out of the queue"""
+
+def _inference_worker_main(conn, shm_name, frame_bytes):
+    """Worker process: read frames from shared memory, write landmarks back"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame_buf = np.ndarray((frame_bytes,), dtype=np.uint8, buffer=shm.buf)
+    out = np.ndarray((LANDMARK_COUNT, 4), dtype=np.float32, buffer=shm.buf, offset=frame_bytes)
+    
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        client_id, h, w = msg
+        landmarks = detect_landmarks(frame_buf[:h * w * 3].reshape(h, w, 3), client_id)
+        if landmarks is not None:
+            out[:] = landmarks
+        conn.send(landmarks is not None)
+    
+    del frame_buf, out
+    shm.close()
+
+class InferenceWorker:
+    """One pose process, its shared-memory buffer and the thread feeding it.
+
+    Clients have their own queues (at most `max_pending` frames each) and
+    are served round-robin, so a client sending bursts cannot starve the
+    others on the same worker.
+    """
+    
+    def __init__(self, ctx, index, max_frame_bytes=MAX_FRAME_BYTES, max_pending=INFERENCE_MAX_PENDING):
+        self.index = index
+        self.max_frame_bytes = max_frame_bytes
+        self.max_pending = max_pending
+        self._ctx = ctx
+        self._shm = shared_memory.SharedMemory(create=True, size=max_frame_bytes + LANDMARK_BYTES)
+        self._frame = np.ndarray((max_frame_bytes,), dtype=np.uint8, buffer=self._shm.buf)
+        self._landmarks = np.ndarray((LANDMARK_COUNT, 4), dtype=np.float32,
+                                     buffer=self._shm.buf, offset=max_frame_bytes)
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # client_id -> deque of (img, future)
+        self._closed = False
+        
+        self.processed = 0
+        self.dropped = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+        self.started = time.monotonic()
+        
+        self._start_process()
+        self._thread = threading.Thread(target=self._run, name=f"inference-{index}", daemon=True)
+        self._thread.start()
+    
+    def submit(self, img, client_id):
+        future = Future()
+        with self._cond:
+            queue = self._queues.get(client_id)
+            if queue is None:
+                queue = self._queues[client_id] = deque()
+            if len(queue) >= self.max_pending:
+                _, stale = queue.popleft()
+                stale.set_exception(FrameDropped())
+                self.dropped += 1
+            queue.append((img, future))
+            self._cond.notify()
+        return future
+    
+    def queue_depth(self):
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+    
+    def stats(self):
+        uptime = time.monotonic() - self.started
+        return {
+            "worker": self.index,
+            "alive": self._process.is_alive(),
+            "queue_depth": self.queue_depth(),
+            "clients_queued": len(self._queues),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+            "frames_per_sec": round(self.processed / uptime, 2) if uptime > 0 else 0,
+            "avg_latency_ms": round(self.busy_seconds * 1000 / self.processed, 2) if self.processed else 0,
+            "utilization": round(self.busy_seconds / uptime, 3) if uptime > 0 else 0
+        }
+    
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=INFERENCE_TIMEOUT)
+        try:
+            self._conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(timeout=INFERENCE_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+        del self._frame, self._landmarks
+        self._shm.close()
+        self._shm.unlink()
+    
+    def _start_process(self):
+        self._conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(
+            target=_inference_worker_main,
+            args=(child_conn, self._shm.name, self.max_frame_bytes),
+            name=f"pose-worker-{self.index}",
+            daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+    
+    def _next_job(self):
+        with self._cond:
+            while not self._queues and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            client_id, queue = next(iter(self._queues.items()))
+            img, future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+            return client_id, img, future
+    
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            client_id, img, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._infer(img, client_id))
+            except Exception as e:
+                future.set_exception(e)
+    
+    def _infer(self, img, client_id):
+        if img.nbytes > self.max_frame_bytes:
+            # Landmarks are normalized, so a smaller frame gives the same coordinates
+            scale = math.sqrt(self.max_frame_bytes / img.nbytes)
+            img = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)),
+                             interpolation=cv2.INTER_AREA)
+        h, w = img.shape[:2]
+        np.copyto(self._frame[:img.nbytes].reshape(h, w, 3), img)
+        
+        start = time.perf_counter()
+        try:
+            self._conn.send((client_id, h, w))
+            found = self._conn.recv()
+        except (EOFError, BrokenPipeError, OSError):
+            # Worker died (e.g. OOM); replace it and fail this frame
+            self.restarts += 1
+            self._start_process()
+            raise
+        self.busy_seconds += time.perf_counter() - start
+        self.processed += 1
+        return self._landmarks.copy() if found else None
+
+class InferenceService:
+    """Pose inference in worker processes.
+
+    Request threads submit decoded frames and wait on a future. Each client
+    is pinned to one worker (by client_id hash) so its estimator keeps
+    tracking across frames; frames travel through shared memory and only
+    the (33, 4) landmark array comes back.
+    """
+    
+    def __init__(self, num_workers=INFERENCE_WORKERS):
+        ctx = multiprocessing.get_context("spawn")
+        self.workers = [InferenceWorker(ctx, i) for i in range(num_workers)]
+    
+    def submit(self, img, client_id):
+        worker = self.workers[zlib.crc32(client_id.encode()) % len(self.workers)]
+        return worker.submit(img, client_id)
+    
+    def infer(self, img, client_id, timeout=INFERENCE_TIMEOUT):
+        return self.submit(img, client_id).result(timeout)
+    
+    def stats(self):
+        workers = [worker.stats() for worker in self.workers]
+        return {
+            "mode": "workers",
+            "queue_depth": sum(w["queue_depth"] for w in workers),
+            "frames_per_sec": round(sum(w["frames_per_sec"] for w in workers), 2),
+            "workers": workers
+        }
+    
+    def shutdown(self):
+        for worker in self.workers:
+            worker.close()
+
+_INFERENCE_SERVICE = None
+_INFERENCE_SERVICE_LOCK = threading.Lock()
+
+def get_inference_service():
+    """Shared inference service, started on first use; None runs pose inline"""
+    global _INFERENCE_SERVICE
+    if INFERENCE_WORKERS <= 0 or mp is None:
+        return None
+    if _INFERENCE_SERVICE is None:
+        with _INFERENCE_SERVICE_LOCK:
+            if _INFERENCE_SERVICE is None:
+                _INFERENCE_SERVICE = InferenceService(INFERENCE_WORKERS)
+                atexit.register(_INFERENCE_SERVICE.shutdown)
+    return _INFERENCE_SERVICE
 
 # ===== UTILITY FUNCTIONS =====
 def decode_b64_image(b64str):
     if "," in b64str:
         b64str = b64str.split(",", 1)[1]
-    img_data = base64.b64decode(b64str)
-    arr = np.frombuffer(img_data, dtype=np.uint8)
-    return cv2.imdecode(arr, cv2.IMREAD_COLOR)
-
-def angle(a, b, c):
-    a, b, c = np.array(a), np.array(b), np.array(c)
-    ba = a - b
-    bc = c - b
-    cosv = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc) + 1e-9)
-    cosv = np.clip(cosv, -1, 1)
-    return float(np.degrees(np.arccos(cosv)))
-
-def get_points(landmarks, w, h):
-    pts = {}
-    for i, lm in enumerate(landmarks.landmark):
-        pts[i] = (lm.x * w, lm.y * h)
-    return pts
+    with timed("b64decode"):
+        buf = base64.b64decode(b64str)
+    return decode_image_bytes(buf)
+
+def decode_image_bytes(buf):
+    """Decode raw JPEG/PNG bytes; np.frombuffer wraps the buffer without copying"""
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    with timed("imdecode"):
+        return cv2.imdecode(arr, cv2.IMREAD_COLOR)
+
+def request_client_id(default="default"):
+    """client_id for binary uploads: X-Client-Id header, then query string"""
+    return request.headers.get("X-Client-Id") or request.args.get("client_id", default)
+
+def request_exercise(default="squat"):
+    """Exercise for binary uploads: X-Exercise header, then query string"""
+    return request.headers.get("X-Exercise") or request.args.get("exercise", default)
+
+def parse_frame_size(w, h):
+    """(width, height) as floats; None unless both are positive finite numbers"""
+    try:
+        w, h = float(w), float(h)
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(w) and math.isfinite(h) and w > 0 and h > 0):
+        return None
+    return w, h
+
+def request_frame_size():
+    """Frame size the landmarks were normalized against (angles depend on aspect ratio); None if malformed"""
+    w = request.headers.get("X-Frame-Width") or request.args.get("width", DEFAULT_FRAME_SIZE[0])
+    h = request.headers.get("X-Frame-Height") or request.args.get("height", DEFAULT_FRAME_SIZE[1])
+    return parse_frame_size(w, h)
+
+def unpack_landmarks(buf):
+    """Packed little-endian float32 (33, 4) landmarks; None if malformed"""
+    if len(buf) != LANDMARK_BYTES:
+        return None
+    landmarks = np.frombuffer(buf, dtype="<f4").reshape(LANDMARK_COUNT, 4)
+    return landmarks if np.isfinite(landmarks).all() else None
+
+def landmarks_from_list(values):
+    try:
+        landmarks = np.asarray(values, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    if landmarks.shape != (LANDMARK_COUNT, 4) or not np.isfinite(landmarks).all():
+        return None
+    return landmarks
+
+# Serialized NormalizedLandmarkList when every landmark sets exactly x, y, z
+# and visibility, as MediaPipe Pose does: per landmark a 2-byte message
+# header, then four (1-byte field tag, little-endian float32) pairs
+_WIRE_RECORD = np.array([0x0a, 0x14, 0x0d, 0, 0, 0, 0, 0x15, 0, 0, 0, 0, 0x1d, 0, 0, 0, 0, 0x25, 0, 0, 0, 0], dtype=np.uint8)
+_WIRE_TAGS = (np.flatnonzero(_WIRE_RECORD) + len(_WIRE_RECORD) * np.arange(LANDMARK_COUNT)[:, None]).ravel()
+_WIRE_FLOATS = np.flatnonzero(_WIRE_RECORD == 0) + len(_WIRE_RECORD) * np.arange(LANDMARK_COUNT)[:, None]
+_WIRE_EXPECTED = np.tile(_WIRE_RECORD, LANDMARK_COUNT)[_WIRE_TAGS]
+
+def landmarks_to_array(landmarks):
+    """MediaPipe landmarks -> (33, 4) float32 array of x, y, z, visibility"""
+    # Reading 132 protobuf attributes costs more than the joint math that
+    # follows; copy the floats out of the serialized bytes when the layout
+    # is the known one, else fall back to attribute reads
+    serialize = getattr(landmarks, "SerializeToString", None)
+    if serialize is not None:
+        raw = np.frombuffer(serialize(), dtype=np.uint8)
+        if raw.size == len(_WIRE_RECORD) * LANDMARK_COUNT and np.array_equal(raw[_WIRE_TAGS], _WIRE_EXPECTED):
+            return raw[_WIRE_FLOATS].view("<f4").astype(np.float32, copy=False)
+    values = chain.from_iterable((lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks.landmark)
+    return np.fromiter(values, dtype=np.float32, count=LANDMARK_COUNT * 4).reshape(LANDMARK_COUNT, 4)
+
+# Joint -> (a, b, c) landmark indices; the angle is measured at b
+JOINT_TRIPLETS = {
+    "left_knee": (23, 25, 27),
+    "right_knee": (24, 26, 28),
+    "left_hip": (11, 23, 25),
+    "right_hip": (12, 24, 26),
+    "left_elbow": (11, 13, 15),
+    "right_elbow": (12, 14, 16),
+    "left_shoulder": (13, 11, 23),
+    "right_shoulder": (14, 12, 24)
+}
+JOINTS = {name: i for i, name in enumerate(JOINT_TRIPLETS)}
+_TRIPLETS = np.array(list(JOINT_TRIPLETS.values())).T  # (3, n_joints)
+_TRIPLET_XY = _TRIPLETS[..., None] * 4 + np.arange(2)  # (3, n_joints, 2) flat indices of x, y
+VISIBILITY_THRESHOLD = 0.3
+
+def joint_angles(landmarks, w, h):
+    """Angles (degrees) at every joint in JOINT_TRIPLETS in one batched pass"""
+    # One gather of just the points the joints use; at this size every numpy call is overhead
+    pts = landmarks.take(_TRIPLET_XY) * np.array([w, h], dtype=np.float64)
+    v = pts[::2] - pts[1]  # (2, n_joints, 2): b->a and b->c
+    sq = (v * v).sum(axis=2)
+    cosv = (v[0] * v[1]).sum(axis=1) / (np.sqrt(sq[0] * sq[1]) + 1e-9)
+    return np.degrees(np.arccos(np.clip(cosv, -1, 1, out=cosv)))
+
+def back_angle_of(landmarks, w, h):
+    """Angle between the hip-midpoint -> shoulder-midpoint line and the vertical"""
+    (sx0, sy0), (sx1, sy1), (hx0, hy0), (hx1, hy1) = landmarks[[11, 12, 23, 24], :2].tolist()
+    dx = (sx0 + sx1 - hx0 - hx1) * 0.5 * w
+    dy = (sy0 + sy1 - hy0 - hy1) * 0.5 * h
+    return abs(math.degrees(math.atan2(dx, dy)))
 
 def calculate_bmi(weight_kg, height_m):
     if height_m > 0:
@@ -82,10 +1286,10 @@ def analyze_sentiment(text):
     else:
         return "neutral", 0.5
 
-def calculate_performance_score(knee_angle, back_angle, symmetry_score, range_of_motion):
+def calculate_performance_score(knee_angle, back_angle, symmetry_score, range_of_motion, target_angle=100):
     """Calculate comprehensive performance score"""
     # Normalize scores
-    knee_score = max(0, min(100, 100 - abs(knee_angle - 100) * 0.5))
+    knee_score = max(0, min(100, 100 - abs(knee_angle - target_angle) * 0.5))
     back_score = max(0, min(100, 100 - back_angle * 2))
     symmetry_score = symmetry_score * 100
     rom_score = range_of_motion * 100
@@ -106,135 +1310,983 @@ def calculate_performance_score(knee_angle, back_angle, symmetry_score, range_of
     
     return int(total_score)
 
-# ===== CORE AI FEATURES =====
+# ===== REP ENGINE =====
+# Each exercise is a two-stage machine over one joint angle (the "metric"):
+# the left/right joints are combined ("mean" of the visible sides, or "min"
+# when one side leads), and every stage has a single transition
+# (comparison, threshold, next stage, whether it completes a rep).
+EXERCISES = {
+    "squat": {
+        "joints": ("left_knee", "right_knee"),
+        "combine": "mean",
+        "start": "up",
+        "transitions": {
+            "up": ("below", 100, "down", False),
+            "down": ("above", 150, "up", True)
+        },
+        "rom_span": 160,
+        "target": 100,
+        "hidden_message": "Can't see legs clearly"
+    },
+    "pushup": {
+        "joints": ("left_elbow", "right_elbow"),
+        "combine": "mean",
+        "start": "up",
+        "transitions": {
+            "up": ("below", 90, "down", False),
+            "down": ("above", 150, "up", True)
+        },
+        "rom_span": 90,
+        "target": 90,
+        "hidden_message": "Can't see arms clearly"
+    },
+    "lunge": {
+        "joints": ("left_knee", "right_knee"),
+        "combine": "min",
+        "start": "up",
+        "transitions": {
+            "up": ("below", 100, "down", False),
+            "down": ("above", 150, "up", True)
+        },
+        "rom_span": 90,
+        "target": 90,
+        "hidden_message": "Can't see legs clearly"
+    },
+    "bicep_curl": {
+        "joints": ("left_elbow", "right_elbow"),
+        "combine": "min",
+        "start": "down",
+        "transitions": {
+            "down": ("below", 50, "up", False),
+            "up": ("above", 150, "down", True)
+        },
+        "rom_span": 120,
+        "target": 40,
+        "hidden_message": "Can't see arms clearly"
+    },
+    "jumping_jack": {
+        "joints": ("left_shoulder", "right_shoulder"),
+        "combine": "mean",
+        "start": "closed",
+        "transitions": {
+            "closed": ("above", 120, "open", False),
+            "open": ("below", 40, "closed", True)
+        },
+        "rom_span": 150,
+        "target": 160,
+        "hidden_message": "Can't see arms clearly"
+    }
+}
+ENABLED_EXERCISES = tuple(name for name in os.environ.get("ENABLED_EXERCISES", ",".join(EXERCISES)).split(",")
+                          if name in EXERCISES)
+EXERCISE_INDEX = {name: i for i, name in enumerate(ENABLED_EXERCISES)}
+STAGES = sorted({stage for ex in EXERCISES.values() for stage in ex["transitions"]})
+STAGE_INDEX = {stage: i for i, stage in enumerate(STAGES)}
 
-# 1. SQUAT COUNTER (Enhanced with performance tracking)
-def squat_counter(img, client_id="c_default"):
-    global CLIENTS, USER_DATA
+# Per-client state: one row per enabled exercise
+REP_STATE_DTYPE = np.dtype([
+    ("stage", np.uint8),
+    ("reps", np.uint32),
+    ("min_angle", np.float32),
+    ("max_angle", np.float32)
+])
 
-    h, w = img.shape[:2]
-    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    res = POSE.process(rgb)
+def _compile_exercises(names):
+    """Exercise tables -> arrays indexed [exercise] or [exercise, stage]"""
+    n, n_stages = len(names), len(STAGES)
+    tables = {
+        "joints": np.zeros((n, 2), dtype=np.intp),
+        "use_min": np.zeros(n, dtype=bool),
+        "rom_span": np.zeros(n),
+        "start": np.zeros(n, dtype=np.uint8),
+        "below": np.zeros((n, n_stages), dtype=bool),
+        # Stages an exercise doesn't use never fire: NaN compares False
+        "threshold": np.full((n, n_stages), np.nan),
+        "next": np.zeros((n, n_stages), dtype=np.uint8),
+        "counts": np.zeros((n, n_stages), dtype=bool)
+    }
+    for i, name in enumerate(names):
+        ex = EXERCISES[name]
+        tables["joints"][i] = [JOINTS[joint] for joint in ex["joints"]]
+        tables["use_min"][i] = ex["combine"] == "min"
+        tables["rom_span"][i] = ex["rom_span"]
+        tables["start"][i] = STAGE_INDEX[ex["start"]]
+        for stage, (direction, threshold, next_stage, counts) in ex["transitions"].items():
+            j = STAGE_INDEX[stage]
+            tables["below"][i, j] = direction == "below"
+            tables["threshold"][i, j] = threshold
+            tables["next"][i, j] = STAGE_INDEX[next_stage]
+            tables["counts"][i, j] = counts
+    return tables
 
-    if not res.pose_landmarks:
-        return {"ok": False, "reason": "no_pose", "message": "No person detected"}
-
-    pts = get_points(res.pose_landmarks, w, h)
-    
-    # Get visibility scores
-    vis = {}
-    for i, lm in enumerate(res.pose_landmarks.landmark):
-        vis[i] = lm.visibility
-    
-    # Landmark definitions
-    left_leg_landmarks = [23, 25, 27]
-    right_leg_landmarks = [24, 26, 28]
-    
-    left_leg_visible = all(idx in pts and vis.get(idx, 0) > 0.3 for idx in left_leg_landmarks)
-    right_leg_visible = all(idx in pts and vis.get(idx, 0) > 0.3 for idx in right_leg_landmarks)
-    
-    if not left_leg_visible and not right_leg_visible:
-        return {"ok": False, "reason": "low_visibility", "message": "Can't see legs clearly"}
-    
-    # Calculate knee angles
-    knee_angles = {}
-    symmetry_score = 0.5
-    range_of_motion = 0.5
-    
-    if left_leg_visible:
-        left_hip, left_knee, left_ankle = pts[23], pts[25], pts[27]
-        knee_angles["left"] = angle(left_hip, left_knee, left_ankle)
-    
-    if right_leg_visible:
-        right_hip, right_knee, right_ankle = pts[24], pts[26], pts[28]
-        knee_angles["right"] = angle(right_hip, right_knee, right_ankle)
-    
-    # Calculate symmetry
-    if left_leg_visible and right_leg_visible:
-        symmetry_score = 1.0 - abs(knee_angles["left"] - knee_angles["right"]) / 180
-        knee_ang = (knee_angles["left"] + knee_angles["right"]) / 2
-        which_leg = "both"
-    elif left_leg_visible:
-        knee_ang = knee_angles["left"]
-        which_leg = "left"
-        symmetry_score = 0.5
-    else:
-        knee_ang = knee_angles["right"]
-        which_leg = "right"
-        symmetry_score = 0.5
-    
-    # Calculate range of motion
-    state = CLIENTS.get(client_id, {"stage": "up", "reps": 0, "min_angle": 180, "max_angle": 0})
-    stage, reps, min_angle, max_angle = state["stage"], state["reps"], state["min_angle"], state["max_angle"]
+EXERCISE_TABLES = _compile_exercises(ENABLED_EXERCISES)
+
+def new_rep_state():
+    state = np.zeros(len(ENABLED_EXERCISES), dtype=REP_STATE_DTYPE)
+    state["stage"] = EXERCISE_TABLES["start"]
+    state["min_angle"] = 180
+    return state
+
+def joint_visibility(landmarks):
+    """Per-joint flags: a joint is usable when all three of its landmarks are visible"""
+    return (landmarks[:, 3][_TRIPLETS] > VISIBILITY_THRESHOLD).all(axis=0)
+
+def evaluate_exercises(angles, joint_visible, state):
+    """Advance every enabled exercise by one frame, updating `state` in place.
+
+    Returns per-exercise arrays: metric angle, symmetry, range of motion,
+    which sides were visible and whether a rep was just completed.
+    Exercises whose joints are hidden keep their state untouched.
+    """
+    t = EXERCISE_TABLES
+    a = angles[t["joints"]]           # (n_exercises, 2)
+    visible = joint_visible[t["joints"]]
+    both = visible.all(axis=1)
+    active = visible.any(axis=1)
+    
+    one_side = np.where(visible[:, 0], a[:, 0], a[:, 1])
+    mean = np.where(both, a.mean(axis=1), one_side)
+    lowest = np.where(both, a.min(axis=1), one_side)
+    metric = np.where(t["use_min"], lowest, mean)
+    symmetry = np.where(both, 1.0 - np.abs(a[:, 0] - a[:, 1]) / 180, 0.5)
+    
+    min_angle = np.where(active, np.minimum(state["min_angle"], metric), state["min_angle"])
+    max_angle = np.where(active, np.maximum(state["max_angle"], metric), state["max_angle"])
+    rom = np.maximum(0.1, (max_angle - min_angle) / t["rom_span"])
+    
+    rows = np.arange(len(state))
+    stage = state["stage"]
+    threshold = t["threshold"][rows, stage]
+    fired = active & np.where(t["below"][rows, stage], metric < threshold, metric > threshold)
+    rep_completed = fired & t["counts"][rows, stage]
+    
+    state["stage"] = np.where(fired, t["next"][rows, stage], stage)
+    state["reps"] += rep_completed
+    state["min_angle"] = min_angle
+    state["max_angle"] = max_angle
     
-    # Update ROM tracking
-    if knee_ang < min_angle:
-        min_angle = knee_ang
-    if knee_ang > max_angle:
-        max_angle = knee_ang
+    return {
+        "metric": metric,
+        "symmetry": symmetry,
+        "rom": rom,
+        "visible": visible,
+        "rep_completed": rep_completed
+    }
+
+# ===== LIVE SESSIONS & MOTION GATE =====
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", 4.0))
+MOTION_MAX_SKIP = int(os.environ.get("MOTION_MAX_SKIP", 10))
+MOTION_THUMB_SIZE = (64, 48)
+MOTION_STATS = {"frames": 0, "skipped": 0}
+
+class ClientSession:
+    """Live state for one client in CLIENTS.
+
+    `reps` holds the rep engine rows; the rest is the motion gate's cache:
+    a thumbnail of the last frame that went through pose inference and the
+    result it produced.
+    """
+    __slots__ = ("reps", "thumbnail", "last_result", "last_exercise", "skipped", "frames", "skips")
     
-    range_of_motion = max(0.1, (max_angle - min_angle) / 160)
+    def __init__(self):
+        self.reps = new_rep_state()
+        self.thumbnail = None
+        self.last_result = None
+        self.last_exercise = None
+        self.skipped = 0  # consecutive cached answers
+        self.frames = 0
+        self.skips = 0
+
+def get_session(client_id):
+    return CLIENTS[client_id]
+
+def motion_gate_stats():
+    frames, skipped = MOTION_STATS["frames"], MOTION_STATS["skipped"]
+    return {
+        "frames": frames,
+        "skipped": skipped,
+        "skip_ratio": round(skipped / frames, 3) if frames else 0
+    }
+
+def motion_thumbnail(img):
+    small = cv2.resize(img, MOTION_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+def motion_gate(session, thumbnail, exercise):
+    """Cached result if the scene hasn't changed since the last inference.
+
+    Compares a 64x48 grayscale thumbnail against the last processed one.
+    At most MOTION_MAX_SKIP frames in a row are answered from cache, so a
+    resting athlete is still re-checked every few seconds, while any
+    movement sends every frame through inference again.
+    """
+    if (session.last_result is None or session.thumbnail is None
+            or session.last_exercise != exercise or session.skipped >= MOTION_MAX_SKIP):
+        return None
+    if cv2.absdiff(thumbnail, session.thumbnail).mean() >= MOTION_THRESHOLD:
+        return None
+    return session.last_result
+
+# ===== SHARED REP STATE (multi-worker) =====
+SHARED_STATE_NAME = os.environ.get("SHARED_STATE_NAME", "")  # empty: rep state stays per process
+SHARED_STATE_SLOTS = int(os.environ.get("SHARED_STATE_SLOTS", 4096))
+SHARED_STATE_STRIPES = 64
+SHARED_STATE_PROBES = 16
+SHARED_STATE_RETRIES = 3
+
+class StripedLocks:
+    """N locks that hold across threads and processes.
+
+    Each stripe is a thread lock plus an fcntl lock on one byte of a
+    shared lock file; fcntl locks alone don't exclude threads of the same
+    process.
+    """
+    
+    def __init__(self, path, stripes):
+        self.stripes = stripes
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+    
+    @contextmanager
+    def hold(self, stripe):
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+class SharedRepState:
+    """Rep engine rows for every client in one shared memory segment.
+
+    Gunicorn workers (or any processes on the host) attach to the same
+    named segment, so a client's frames can land on any worker without
+    resetting or double-counting reps. The segment is an open-addressing
+    table keyed by a 128-bit hash of the client id. Updates are optimistic:
+    read the row and its version, run the rep engine on a copy, then
+    compare-and-update under the row's stripe lock, retrying if another
+    worker got there first.
+    """
+    
+    def __init__(self, name, slots=SHARED_STATE_SLOTS, stripes=SHARED_STATE_STRIPES):
+        n = len(ENABLED_EXERCISES)
+        self.slot_dtype = np.dtype([
+            ("key", np.uint64, 2),
+            ("version", np.uint64),
+            ("updated", np.float64),
+            ("reps", REP_STATE_DTYPE, (n,))
+        ])
+        self.slots = slots
+        self.stripes = stripes
+        # Byte `stripes` of the lock file guards slot claims and segment setup
+        self.locks = StripedLocks(os.path.join(tempfile.gettempdir(), f"{name}.lock"), stripes + 1)
+        self.claims = 0
+        self.evictions = 0
+        self.conflicts = 0
+        
+        layout = np.array([0x52455053, n, slots, zlib.crc32(",".join(ENABLED_EXERCISES).encode())], dtype=np.uint64)
+        size = layout.nbytes + slots * self.slot_dtype.itemsize
+        with self.locks.hold(stripes):
+            try:
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+                created = True
+            except FileExistsError:
+                self._shm = shared_memory.SharedMemory(name=name)
+                created = False
+            # The segment outlives any one worker: keep the resource tracker from unlinking it
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self._shm._name, "shared_memory")
+            except Exception:
+                pass
+            header = np.ndarray(layout.shape, dtype=np.uint64, buffer=self._shm.buf)
+            if created:
+                header[:] = layout
+            elif not np.array_equal(header, layout):
+                raise RuntimeError(f"Shared state segment {name!r} was created with different exercises or "
+                                   "slot count; stop all workers or choose another SHARED_STATE_NAME")
+        self.table = np.ndarray((slots,), dtype=self.slot_dtype, buffer=self._shm.buf, offset=layout.nbytes)
+    
+    @staticmethod
+    def key_of(client_id):
+        digest = hashlib.blake2b(str(client_id).encode(), digest_size=16).digest()
+        return np.frombuffer(digest, dtype=np.uint64)
+    
+    def update(self, client_id, fn):
+        """Apply fn(state) to the client's rep state atomically; (new state, fn's result)"""
+        key = self.key_of(client_id)
+        slot = self._find(key)
+        if slot is None:
+            slot = self._claim(key, client_id)
+        row = self.table[slot]
+        
+        for _ in range(SHARED_STATE_RETRIES):
+            version = int(row["version"])  # read before the state, written after it
+            state = row["reps"].copy()
+            result = fn(state)
+            if self._compare_and_update(slot, key, version, state):
+                return state, result
+            self.conflicts += 1
+            if not np.array_equal(row["key"], key):
+                slot = self._claim(key, client_id)  # evicted meanwhile
+                row = self.table[slot]
+        
+        # Heavily contended: run fn under the lock
+        while True:
+            with self.locks.hold(slot % self.stripes):
+                if np.array_equal(row["key"], key):
+                    state = row["reps"].copy()
+                    result = fn(state)
+                    self._write(row, state)
+                    return state, result
+            slot = self._claim(key, client_id)
+            row = self.table[slot]
+    
+    def stats(self):
+        used = int(np.count_nonzero(self.table["key"].any(axis=1)))
+        return {
+            "segment": self._shm.name,
+            "slots": self.slots,
+            "used": used,
+            "claims": self.claims,
+            "evictions": self.evictions,
+            "conflicts": self.conflicts
+        }
     
-    # Rep counting logic
-    if knee_ang < 100 and stage == "up":
-        stage = "down"
+    def _probe(self, key):
+        home = int(key[0] % self.slots)
+        return [(home + i) % self.slots for i in range(SHARED_STATE_PROBES)]
+    
+    def _find(self, key):
+        keys = self.table["key"]
+        for slot in self._probe(key):
+            if keys[slot, 0] == key[0] and keys[slot, 1] == key[1]:
+                return slot
+        return None
+    
+    def _claim(self, key, client_id):
+        state = restore_rep_state(client_id, new_rep_state())
+        with self.locks.hold(self.stripes):
+            slot = self._find(key)
+            if slot is not None:
+                return slot
+            probe = self._probe(key)
+            empty = [slot for slot in probe if not self.table["key"][slot].any()]
+            if empty:
+                slot = empty[0]
+            else:
+                # Window full: take over the least recently updated client
+                slot = min(probe, key=lambda i: self.table["updated"][i])
+                self.evictions += 1
+            with self.locks.hold(slot % self.stripes):
+                row = self.table[slot]
+                row["key"] = key
+                self._write(row, state)
+            self.claims += 1
+            return slot
+    
+    def _compare_and_update(self, slot, key, version, state):
+        with self.locks.hold(slot % self.stripes):
+            row = self.table[slot]
+            if int(row["version"]) != version or not np.array_equal(row["key"], key):
+                return False
+            self._write(row, state)
+            return True
+    
+    @staticmethod
+    def _write(row, state):
+        row["reps"] = state
+        row["updated"] = time.time()
+        row["version"] += 1
+
+_SHARED_REP_STATE = None
+_SHARED_REP_STATE_PID = None
+_SHARED_REP_STATE_LOCK = threading.Lock()
+
+def get_shared_rep_state():
+    """Shared rep state if SHARED_STATE_NAME is set (attached once per process), else None"""
+    global _SHARED_REP_STATE, _SHARED_REP_STATE_PID
+    if not SHARED_STATE_NAME:
+        return None
+    if fcntl is None:
+        print("⚠ SHARED_STATE_NAME needs fcntl (POSIX); keeping rep state per process")
+        return None
+    pid = os.getpid()
+    if _SHARED_REP_STATE_PID != pid:
+        with _SHARED_REP_STATE_LOCK:
+            if _SHARED_REP_STATE_PID != pid:
+                _SHARED_REP_STATE = SharedRepState(SHARED_STATE_NAME)
+                _SHARED_REP_STATE_PID = pid
+    return _SHARED_REP_STATE
+
+# ===== MEAL PLANNER (food table) =====
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+FOOD_TABLE_PATH = os.environ.get("FOOD_TABLE_PATH", os.path.join(DATA_DIR, "foods.csv"))
+MEAL_PLAN_CACHE_SIZE = int(os.environ.get("MEAL_PLAN_CACHE_SIZE", 1024))
+MEALS = ("breakfast", "lunch", "dinner", "snacks")
+MEAL_SHARES = np.array([0.25, 0.35, 0.30, 0.10])  # share of daily calories; matches the dashboard
+PLAN_CALORIE_STEP = 50  # profile quantization for the plan cache
+PLAN_MACRO_STEP = 5
+PLAN_ITERATIONS = 400
+PLAN_PORTION_STEP = 5  # grams
+
+class MealPlanner:
+    """Meal portions solved against a food-nutrient table.
+
+    The table (one row per food and meal slot, nutrients per 100 g, the
+    largest sensible portion and the diets it belongs to) is loaded once
+    into NumPy arrays. For a diet, every food tagged with it is on the
+    menu; the solver picks portions so the day hits the calorie and
+    protein/carbs/fat targets and each meal gets its share of calories
+    (MEAL_SHARES), as a bounded least-squares problem solved by
+    accelerated projected gradient. Plans are cached per quantized
+    (calories, macros, diet) profile, so similar users share one solve.
+    """
+    
+    def __init__(self, path=FOOD_TABLE_PATH, cache_size=MEAL_PLAN_CACHE_SIZE):
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.names = [row["name"] for row in rows]
+        self.meal = np.array([MEALS.index(row["meal"]) for row in rows])
+        # Per 100 g: kcal, protein, carbs, fat
+        self.nutrients = np.array([[float(row[k]) for k in ("kcal", "protein_g", "carbs_g", "fat_g")] for row in rows])
+        self.max_portion = np.array([float(row["max_g"]) for row in rows]) / 100
+        diets = [set(row["diets"].split()) for row in rows]
+        self.diets = {diet: np.array([diet in d for d in diets]) for diet in set().union(*diets)}
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def plan(self, calories, protein_g, carbs_g, fat_g, diet):
+        """{"meals": {meal: [(food, grams), ...]}, "totals": {...}, "grocery": [...]}"""
+        if diet not in self.diets:
+            diet = "balanced"
+        key = (round(calories / PLAN_CALORIE_STEP), round(protein_g / PLAN_MACRO_STEP),
+               round(carbs_g / PLAN_MACRO_STEP), round(fat_g / PLAN_MACRO_STEP), diet)
+        with self._lock:
+            plan = self._cache.get(key)
+            if plan is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+        
+        targets = np.array([key[0] * PLAN_CALORIE_STEP, key[1] * PLAN_MACRO_STEP,
+                            key[2] * PLAN_MACRO_STEP, key[3] * PLAN_MACRO_STEP], dtype=np.float64)
+        plan = self._solve(np.flatnonzero(self.diets[diet]), np.maximum(targets, 1))
+        with self._lock:
+            self._cache[key] = plan
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return plan
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0
+        }
     
-    if knee_ang > 150 and stage == "down":
-        stage = "up"
-        reps += 1
+    def _solve(self, foods, targets):
+        nutrients = self.nutrients[foods]
+        upper = self.max_portion[foods]
         
-        # Save rep data for performance analysis
-        user_data = USER_DATA[client_id]
-        rep_data = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "knee_angle": round(knee_ang, 1),
-            "symmetry": symmetry_score,
-            "rom": range_of_motion
+        # Residual rows, each scaled by its target so errors are relative:
+        # daily kcal (weighted up: it wins when the macros can't all be met
+        # within the diet), protein/carbs/fat, kcal per meal, and a light
+        # pull towards half portions so no food on the menu is dropped
+        in_meal = self.meal[foods] == np.arange(len(MEALS))[:, None]
+        meal_kcal = targets[0] * MEAL_SHARES
+        weights = np.array([3.0, 1.0, 1.0, 1.0])[:, None]
+        A = np.vstack([
+            weights * nutrients.T / targets[:, None],
+            0.5 * in_meal * nutrients[:, 0] / meal_kcal[:, None],
+            0.1 * np.diag(1 / upper)
+        ])
+        b = np.concatenate([weights[:, 0], np.full(len(MEALS), 0.5), np.full(len(foods), 0.05)])
+        
+        # FISTA on ||Ax - b||^2 over the box 0 <= x <= upper
+        step = 1 / (2 * np.linalg.norm(A, 2) ** 2)
+        x = y = upper / 2
+        t = 1.0
+        for _ in range(PLAN_ITERATIONS):
+            x_next = np.clip(y - step * 2 * (A.T @ (A @ y - b)), 0, upper)
+            t_next = (1 + math.sqrt(1 + 4 * t * t)) / 2
+            y = x_next + (t - 1) / t_next * (x_next - x)
+            x, t = x_next, t_next
+        
+        grams = np.round(x * 100 / PLAN_PORTION_STEP) * PLAN_PORTION_STEP
+        totals = grams @ nutrients / 100
+        meals = {meal: [] for meal in MEALS}
+        weekly = {}
+        for i, g in zip(foods, grams):
+            if g > 0:
+                name = self.names[i]
+                meals[MEALS[self.meal[i]]].append((name, int(g)))
+                weekly[name] = weekly.get(name, 0) + int(g) * 7
+        return {
+            "meals": meals,
+            "totals": {
+                "calories": round(totals[0]),
+                "protein_g": round(totals[1]),
+                "carbs_g": round(totals[2]),
+                "fat_g": round(totals[3])
+            },
+            "grocery": [f"{name} ({grams / 1000:g} kg/week)" if grams >= 1000 else f"{name} ({grams} g/week)"
+                        for name, grams in weekly.items()]
         }
-        user_data["workout_history"].append(rep_data)
+
+_MEAL_PLANNER = None
+_MEAL_PLANNER_LOCK = threading.Lock()
+
+def get_meal_planner():
+    """The meal planner, loaded on first use; None if the food table is missing"""
+    global _MEAL_PLANNER
+    if _MEAL_PLANNER is None:
+        with _MEAL_PLANNER_LOCK:
+            if _MEAL_PLANNER is None:
+                try:
+                    _MEAL_PLANNER = MealPlanner()
+                except OSError as e:
+                    print(f"⚠ Food table not loaded ({e}); diet plans use the fixed meal suggestions")
+                    _MEAL_PLANNER = False
+    return _MEAL_PLANNER or None
+
+# ===== GYM CATALOG (spatial index) =====
+GYM_CATALOG_PATH = os.environ.get("GYM_CATALOG_PATH", os.path.join(DATA_DIR, "gyms.csv"))
+CITY_TABLE_PATH = os.environ.get("CITY_TABLE_PATH", os.path.join(DATA_DIR, "cities.csv"))
+GYM_GRID_DEGREES = float(os.environ.get("GYM_GRID_DEGREES", 0.05))  # grid cell side, ~5.5 km of latitude
+GYM_DEFAULT_RADIUS_MILES = 5
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_MILE = 1.609344
+# Accepted range of each numeric gym search field
+GYM_SEARCH_LIMITS = {
+    "radius": (0.1, 100),  # miles
+    "lat": (-90, 90),
+    "lon": (-180, 180)
+}
+
+def gym_search_value(key, value):
+    """value as a float within GYM_SEARCH_LIMITS[key]; raises ValueError otherwise"""
+    low, high = GYM_SEARCH_LIMITS[key]
+    try:
+        number = float(value) if isinstance(value, (int, float, str)) and not isinstance(value, bool) else None
+    except ValueError:
+        number = None
+    if number is None or not (math.isfinite(number) and low <= number <= high):
+        raise ValueError(f"{key} must be a number from {low} to {high}, got {value!r}")
+    return number
+
+def parse_gym_search_area(data):
+    """(radius, lat, lon) from a gym request, None where not given.
+
+    Raises ValueError when a value is not a number within
+    GYM_SEARCH_LIMITS or only one of lat/lon is given.
+    """
+    radius, lat, lon = (data.get(key) for key in ("radius", "lat", "lon"))
+    if (lat is None) != (lon is None):
+        raise ValueError("lat and lon must be given together")
+    return tuple(None if value in (None, "") else gym_search_value(key, value)
+                 for key, value in (("radius", radius), ("lat", lat), ("lon", lon)))
+
+class TagBits:
+    """Tag vocabulary and one bitset row (uint64 words) per item"""
+    
+    def __init__(self, tag_lists):
+        self.index = {}
+        for tags in tag_lists:
+            for tag in tags:
+                self.index.setdefault(tag, len(self.index))
+        words = max(1, (len(self.index) + 63) // 64)
+        self.bits = np.zeros((len(tag_lists), words), dtype=np.uint64)
+        for row, tags in enumerate(tag_lists):
+            for tag in tags:
+                i = self.index[tag]
+                self.bits[row, i // 64] |= np.uint64(1 << (i % 64))
+    
+    def query(self, tags):
+        """Bitset of the known tags in `tags` (unknown ones match nothing)"""
+        mask = np.zeros(self.bits.shape[1], dtype=np.uint64)
+        for tag in tags:
+            i = self.index.get(tag)
+            if i is not None:
+                mask[i // 64] |= np.uint64(1 << (i % 64))
+        return mask
+    
+    def any_of(self, rows, mask):
+        """Per row: has at least one of the tags in mask"""
+        return (self.bits[rows] & mask).any(axis=1)
+
+class GymCatalog:
+    """Gyms loaded once into arrays, bucketed in a lat/lon grid.
+
+    Gyms are sorted by grid cell key (row, column of a GYM_GRID_DEGREES
+    grid), so the gyms of one grid row's span of columns are one
+    contiguous slice found with searchsorted. A radius query reads only
+    the cells overlapping the search box, then filters by exact
+    great-circle distance. Features and specialties are bitsets and the
+    budget a price level array, so filters are vectorized masks over the
+    candidates, and the best k are picked with a heap.
+    """
+    
+    def __init__(self, path=GYM_CATALOG_PATH, city_path=CITY_TABLE_PATH, grid_degrees=GYM_GRID_DEGREES):
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        lat = np.array([float(r["lat"]) for r in rows])
+        lon = np.array([float(r["lon"]) for r in rows])
+        self.grid = grid_degrees
+        keys = self._cell_key(self._cell(lat), self._cell(lon))
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        rows = [rows[i] for i in order]
+        
+        self.lat, self.lon = lat[order], lon[order]
+        self.rating = np.array([float(r["rating"]) for r in rows])
+        self.price_level = np.array([len(r["price_range"]) for r in rows], dtype=np.int8)
+        self.features = [r["features"].split("|") if r["features"] else [] for r in rows]
+        self.specialties = [r["specialties"].split("|") if r["specialties"] else [] for r in rows]
+        self.feature_bits = TagBits(self.features)
+        self.specialty_bits = TagBits(self.specialties)
+        self.crossfit = np.array(["CrossFit" in r["name"] for r in rows])
+        self.rows = [{k: r[k] for k in ("name", "address", "price_range", "membership_fee")} for r in rows]
+        
+        self.cities = {}
+        if os.path.exists(city_path):
+            with open(city_path, newline="") as f:
+                self.cities = {r["name"].strip().lower(): (float(r["lat"]), float(r["lon"])) for r in csv.DictReader(f)}
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def locate(self, location, lat=None, lon=None):
+        """(lat, lon) from explicit coordinates, "lat,lon", or a known city name"""
+        if lat is not None and lon is not None:
+            return float(lat), float(lon)
+        try:
+            lat, lon = str(location).split(",")
+            return gym_search_value("lat", lat.strip()), gym_search_value("lon", lon.strip())
+        except ValueError:
+            pass
+        return self.cities.get(str(location).strip().lower())
+    
+    def within(self, lat, lon, radius_km):
+        """(gym indices, distances in km) for gyms within radius_km"""
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        dlon = dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+        row_lo, row_hi = self._cell(lat - dlat), self._cell(lat + dlat)
+        col_lo, col_hi = self._cell(lon - dlon), self._cell(lon + dlon)
+        rows = np.arange(row_lo, row_hi + 1)
+        starts = np.searchsorted(self.keys, self._cell_key(rows, col_lo), side="left")
+        ends = np.searchsorted(self.keys, self._cell_key(rows, col_hi), side="right")
+        candidates = np.concatenate([np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist())] or [[]]).astype(np.int64)
+        distances = self.haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        inside = distances <= radius_km
+        return candidates[inside], distances[inside]
+    
+    def search(self, lat, lon, radius_km, budget=None, features=None, specialties=None, intensity=None, k=5):
+        """Top k gyms by rating, then distance, among those in range passing the filters.
+
+        Returns (top [(index, km)], in-range count, nearest in-range (index, km) or None).
+        """
+        idx, dist = self.within(lat, lon, radius_km)
+        nearest = (int(idx[dist.argmin()]), float(dist.min())) if len(idx) else None
+        keep = np.ones(len(idx), dtype=bool)
+        if budget:
+            keep &= self.price_level[idx] <= budget
+        if features:
+            keep &= self.feature_bits.any_of(idx, self.feature_bits.query(features))
+        if specialties:
+            keep &= self.specialty_bits.any_of(idx, self.specialty_bits.query(specialties))
+        if intensity == "high":
+            keep &= self.specialty_bits.any_of(idx, self.specialty_bits.query(["High-intensity"])) | self.crossfit[idx]
+        elif intensity == "low":
+            keep &= self.specialty_bits.any_of(idx, self.specialty_bits.query(["Beginner", "Yoga"]))
         
-        # Limit history
-        if len(user_data["workout_history"]) > 100:
-            user_data["workout_history"] = user_data["workout_history"][-100:]
+        top = heapq.nsmallest(k, zip((-self.rating[idx[keep]]).tolist(), dist[keep].tolist(), idx[keep].tolist()))
+        return [(i, d) for _, d, i in top], len(idx), nearest
+    
+    def gym(self, i, distance_km):
+        """Response dict for gym i, in the shape the gym finder UI renders"""
+        return dict(self.rows[i], rating=float(self.rating[i]), features=self.features[i],
+                    specialties=self.specialties[i], distance=f"{distance_km / KM_PER_MILE:.1f} miles")
+    
+    @staticmethod
+    def haversine_km(lat, lon, lats, lons):
+        lat1, lat2 = math.radians(lat), np.radians(lats)
+        h = (np.sin((lat2 - lat1) / 2) ** 2
+             + math.cos(lat1) * np.cos(lat2) * np.sin(np.radians(lons - lon) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(h))
+    
+    def _cell(self, degrees):
+        return np.floor(np.asarray(degrees) / self.grid).astype(np.int64)
+    
+    @staticmethod
+    def _cell_key(row, col):
+        # Row-major and non-negative: one grid row's columns are a contiguous key range
+        return ((np.asarray(row) + (1 << 30)) << 32) | (np.asarray(col) + (1 << 31))
+
+_GYM_CATALOG = None
+_GYM_CATALOG_LOCK = threading.Lock()
+
+def get_gym_catalog():
+    """The gym catalog, loaded on first use"""
+    global _GYM_CATALOG
+    if _GYM_CATALOG is None:
+        with _GYM_CATALOG_LOCK:
+            if _GYM_CATALOG is None:
+                _GYM_CATALOG = GymCatalog()
+    return _GYM_CATALOG
+
+# ===== RESULT CACHE =====
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 4096))
+DATA_CHECK_INTERVAL = float(os.environ.get("DATA_CHECK_INTERVAL", 5))  # seconds between data file checks
+
+def canonical(value):
+    """Inputs normalized so equal requests hash equally (70 and 70.0 alike)"""
+    if isinstance(value, dict):
+        return {str(k): canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+class ResultCache:
+    """LRU of computed responses for endpoints that are pure functions of their inputs.
+
+    Entries are keyed by a hash of (namespace, data version, canonical
+    inputs); the same hash is the response's ETag, so a client that sends
+    it back in If-None-Match gets an empty 304. When a data file changes,
+    data_version() moves on and the cache is cleared.
+    """
+    
+    def __init__(self, max_size=RESULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.not_modified = defaultdict(int)
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def key(namespace, inputs):
+        text = json.dumps([namespace, data_version(), canonical(inputs)], sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    def get_or_compute(self, namespace, inputs, compute):
+        """(etag, result); compute() runs only on a miss"""
+        key = self.key(namespace, inputs)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits[namespace] += 1
+                return key, result
+            self.misses[namespace] += 1
+        result = compute()
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return key, result
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def count_not_modified(self, namespace):
+        with self._lock:
+            self.not_modified[namespace] += 1
+    
+    def stats(self):
+        with self._lock:
+            namespaces = sorted(set(self.hits) | set(self.misses))
+            return {
+                "size": len(self._entries),
+                "evictions": self.evictions,
+                "namespaces": {
+                    ns: {
+                        "hits": self.hits[ns],
+                        "misses": self.misses[ns],
+                        "not_modified": self.not_modified[ns],
+                        "hit_ratio": round(self.hits[ns] / (self.hits[ns] + self.misses[ns]), 3)
+                    } for ns in namespaces
+                }
+            }
+
+RESULT_CACHE = ResultCache()
+
+_DATA_VERSION = 0
+_DATA_STAMP = None
+_DATA_CHECKED = -math.inf
+_DATA_LOCK = threading.Lock()
+
+def data_version():
+    """Counter that moves on when a data file (foods, gyms, cities) changes.
+
+    Files are stat'ed at most every DATA_CHECK_INTERVAL seconds. A change
+    drops the loaded meal planner and gym catalog (they reload on next use)
+    and clears the result cache.
+    """
+    global _DATA_VERSION, _DATA_STAMP, _DATA_CHECKED, _MEAL_PLANNER, _GYM_CATALOG
+    if time.monotonic() - _DATA_CHECKED < DATA_CHECK_INTERVAL:
+        return _DATA_VERSION
+    with _DATA_LOCK:
+        if time.monotonic() - _DATA_CHECKED >= DATA_CHECK_INTERVAL:
+            stamp = []
+            for path in (FOOD_TABLE_PATH, GYM_CATALOG_PATH, CITY_TABLE_PATH):
+                try:
+                    st = os.stat(path)
+                    stamp.append((st.st_mtime_ns, st.st_size))
+                except OSError:
+                    stamp.append(None)
+            if _DATA_STAMP is not None and stamp != _DATA_STAMP:
+                _MEAL_PLANNER = None
+                _GYM_CATALOG = None
+                _DATA_VERSION += 1
+                RESULT_CACHE.clear()
+            _DATA_STAMP = stamp
+            _DATA_CHECKED = time.monotonic()
+    return _DATA_VERSION
+
+def cached_response(namespace, inputs, compute, finish=None):
+    """JSON response for compute(), served from RESULT_CACHE with an ETag.
+
+    finish(result) adds any non-deterministic parts before sending; the
+    ETag is then weak, since equal ETags no longer mean equal bytes.
+    
+    These routes are POSTs, and HTTP only defines 304 for GET/HEAD, so
+    browsers never revalidate them on their own. A matching If-None-Match
+    is this app's own contract: "I still hold the body that came with
+    this ETag", answered with an empty 304. Clients that don't send it
+    (or send a stale one) always get the full body; script.js keeps the
+    last body per route and sends its ETag back (postCached).
+    """
+    etag, result = RESULT_CACHE.get_or_compute(namespace, inputs, compute)
+    weak = finish is not None
+    if request.if_none_match.contains_weak(etag):
+        RESULT_CACHE.count_not_modified(namespace)
+        response = Response(status=304)
+    else:
+        response = jsonify(finish(result) if finish else result)
+    response.set_etag(etag, weak=weak)
+    response.headers["Cache-Control"] = "no-cache"  # revalidate every time
+    return response
+
+# ===== CORE AI FEATURES =====
+
+# 1. SQUAT COUNTER (Enhanced with performance tracking)
+def squat_counter(img, client_id="c_default", exercise="squat"):
+    if mp is None:
+        return {"ok": False, "reason": "no_model", "message": "Pose model not installed"}
+
+    lock = client_lock(client_id)
+    with timed("motion_gate"):
+        thumbnail = motion_thumbnail(img)
+    with lock:
+        session = get_session(client_id)
+        session.frames += 1
+        MOTION_STATS["frames"] += 1
+        cached = motion_gate(session, thumbnail, exercise)
+        if cached is not None:
+            session.skipped += 1
+            session.skips += 1
+            MOTION_STATS["skipped"] += 1
+            return dict(cached, fresh=False, skip_ratio=round(session.skips / session.frames, 2))
+    
+    h, w = img.shape[:2]
+    service = get_inference_service()
+    if service:
+        try:
+            with timed("pose"):
+                landmarks = service.infer(img, client_id)
+        except (FrameDropped, FutureTimeout, EOFError, OSError):
+            return {"ok": False, "reason": "busy", "message": "Server busy, frame skipped"}
+    else:
+        with timed("pose"):
+            landmarks = detect_landmarks(img, client_id)
+
+    # Pose ran unlocked; the rest is this client's read-modify-write
+    with lock:
+        if landmarks is None:
+            result = {"ok": False, "reason": "no_pose", "message": "No person detected"}
+        else:
+            with timed("count_reps"):
+                result = count_reps(landmarks, w, h, client_id, exercise)
+        
+        session.thumbnail = thumbnail
+        session.last_result = result
+        session.last_exercise = exercise
+        session.skipped = 0
+        return dict(result, fresh=True, skip_ratio=round(session.skips / session.frames, 2))
+
+def count_reps(landmarks, w, h, client_id, exercise="squat"):
+    """Rep counting, scoring and feedback for one frame's landmarks.
+
+    Every enabled exercise detector is updated from the same landmark
+    array; the response describes `exercise`, the one the client is doing.
+    """
+    with client_lock(client_id):
+        return _count_reps(landmarks, w, h, client_id, exercise)
+
+def _count_reps(landmarks, w, h, client_id, exercise):
+    if exercise not in EXERCISE_INDEX:
+        return {"ok": False, "reason": "unknown_exercise", "message": f"Unknown exercise: {exercise}"}
+    
+    angles = joint_angles(landmarks, w, h)
+    joint_visible = joint_visibility(landmarks)
+    shared = get_shared_rep_state()
+    if shared:
+        state, frame = shared.update(client_id, lambda state: evaluate_exercises(angles, joint_visible, state))
+    else:
+        state = get_session(client_id).reps
+        frame = evaluate_exercises(angles, joint_visible, state)
+    
+    i = EXERCISE_INDEX[exercise]
+    if not frame["visible"][i].any():
+        return {"ok": False, "reason": "low_visibility", "message": EXERCISES[exercise]["hidden_message"]}
+    
+    left_visible, right_visible = frame["visible"][i]
+    which_leg = "both" if left_visible and right_visible else "left" if left_visible else "right"
+    knee_ang = float(frame["metric"][i])
+    symmetry_score = float(frame["symmetry"][i])
+    range_of_motion = float(frame["rom"][i])
+    reps = int(state["reps"][i])
+    stage = STAGES[state["stage"][i]]
     
     # Calculate back angle
-    back_angle = 0
-    if 11 in pts and 12 in pts and 23 in pts and 24 in pts:
-        left_shoulder = pts[11]
-        right_shoulder = pts[12]
-        left_hip = pts[23]
-        right_hip = pts[24]
-        shoulder_mid = ((left_shoulder[0] + right_shoulder[0]) / 2, (left_shoulder[1] + right_shoulder[1]) / 2)
-        hip_mid = ((left_hip[0] + right_hip[0]) / 2, (left_hip[1] + right_hip[1]) / 2)
-        dx = shoulder_mid[0] - hip_mid[0]
-        dy = shoulder_mid[1] - hip_mid[1]
-        back_angle = abs(np.degrees(np.arctan2(dx, dy)))
+    back_angle = back_angle_of(landmarks, w, h)
     
     # Calculate performance score
     performance_score = calculate_performance_score(
-        knee_ang, back_angle, symmetry_score, range_of_motion
+        knee_ang, back_angle, symmetry_score, range_of_motion,
+        target_angle=EXERCISES[exercise]["target"]
     )
     
-    # Store state
-    CLIENTS[client_id] = {
-        "stage": stage, 
-        "reps": reps, 
-        "min_angle": min_angle, 
-        "max_angle": max_angle,
-        "last_knee_angle": knee_ang
-    }
-    
     # Update performance scores
     user_data = USER_DATA[client_id]
     user_data["performance_scores"].append(performance_score)
-    if len(user_data["performance_scores"]) > 50:
-        user_data["performance_scores"] = user_data["performance_scores"][-50:]
+    if frame["rep_completed"][i]:
+        # Save rep data for performance analysis
+        rep_row = (time.time(), i, knee_ang, symmetry_score, range_of_motion, performance_score)
+        user_data["rep_history"].append(rep_row)
+        save_rep(client_id, exercise, state, rep_row)
     
     # Feedback generation
-    feedback = generate_feedback(knee_ang, back_angle, symmetry_score, range_of_motion)
+    feedback = generate_feedback(knee_ang, back_angle, symmetry_score, range_of_motion, exercise)
     
     return {
         "ok": True, 
+        "exercise": exercise,
         "reps": reps, 
         "knee_angle": round(knee_ang, 1), 
         "feedback": feedback,
@@ -246,22 +2298,27 @@ def squat_counter(img, client_id="c_default"):
         "rom_score": round(range_of_motion * 100),
         "performance_score": performance_score,
         "back_angle": round(back_angle, 1),
-        "weekly_trend": calculate_weekly_trend(user_data["performance_scores"])
+        "weekly_trend": user_data["performance_scores"].trend(),
+        "exercises": {
+            name: {"reps": int(state["reps"][j]), "stage": STAGES[state["stage"][j]]}
+            for j, name in enumerate(ENABLED_EXERCISES)
+        }
     }
 
-def generate_feedback(knee_angle, back_angle, symmetry, rom):
+def generate_feedback(knee_angle, back_angle, symmetry, rom, exercise="squat"):
     feedback_parts = []
     
-    if knee_angle < 80:
-        feedback_parts.append("Excellent depth!")
-    elif knee_angle < 100:
-        feedback_parts.append("Good depth")
-    elif knee_angle < 120:
-        feedback_parts.append("Go deeper for full ROM")
-    else:
-        feedback_parts.append("Squat deeper for better results")
+    if exercise == "squat":
+        if knee_angle < 80:
+            feedback_parts.append("Excellent depth!")
+        elif knee_angle < 100:
+            feedback_parts.append("Good depth")
+        elif knee_angle < 120:
+            feedback_parts.append("Go deeper for full ROM")
+        else:
+            feedback_parts.append("Squat deeper for better results")
     
-    if back_angle > 20:
+    if exercise in ("squat", "lunge") and back_angle > 20:
         feedback_parts.append("Keep chest up and back straight")
     
     if symmetry < 0.7:
@@ -270,6 +2327,9 @@ def generate_feedback(knee_angle, back_angle, symmetry, rom):
     if rom < 0.6:
         feedback_parts.append("Increase your range of motion")
     
+    if not feedback_parts:
+        feedback_parts.append("Good form, keep going")
+    
     return ". ".join(feedback_parts)
 
 def calculate_weekly_trend(scores):
@@ -282,9 +2342,9 @@ def calculate_weekly_trend(scores):
     if len(older) == 0:
         return "Establishing baseline"
     
-    avg_recent = sum(recent) / len(recent)
-    avg_older = sum(older) / len(older)
-    
+    return weekly_trend_label(float(np.mean(recent)), float(np.mean(older)))
+
+def weekly_trend_label(avg_recent, avg_older):
     if avg_recent > avg_older + 5:
         return "↑ Improving steadily"
     elif avg_recent > avg_older:
@@ -295,6 +2355,76 @@ def calculate_weekly_trend(scores):
         return "→ Stable performance"
 
 # 2. AI DIETICIAN & CALORIE COACH
+# Fixed meal suggestions, used when the food table can't be loaded
+MEAL_PLANS = {
+    "balanced": {
+        "breakfast": "Oatmeal with berries and almonds, Greek yogurt",
+        "lunch": "Grilled chicken breast, quinoa, mixed vegetables",
+        "dinner": "Salmon, sweet potato, broccoli",
+        "snacks": "Apple with peanut butter, protein shake"
+    },
+    "vegetarian": {
+        "breakfast": "Tofu scramble with vegetables, whole grain toast",
+        "lunch": "Lentil soup, mixed salad with chickpeas",
+        "dinner": "Vegetable stir-fry with tofu and brown rice",
+        "snacks": "Greek yogurt, handful of nuts"
+    },
+    "vegan": {
+        "breakfast": "Chia seed pudding with fruits, almond milk",
+        "lunch": "Chickpea salad, vegetable soup",
+        "dinner": "Black bean burgers with sweet potato fries",
+        "snacks": "Hummus with vegetables, fruit smoothie"
+    },
+    "keto": {
+        "breakfast": "Avocado and eggs, bacon",
+        "lunch": "Chicken salad with olive oil dressing",
+        "dinner": "Steak with asparagus and butter",
+        "snacks": "Cheese cubes, almonds"
+    }
+}
+
+ACTIVITY_MULTIPLIERS = {
+    "sedentary": 1.2,
+    "light": 1.375,
+    "moderate": 1.55,
+    "active": 1.725,
+    "very_active": 1.9
+}
+GOAL_ADJUSTMENTS = {
+    "loss": -500,
+    "maintain": 0,
+    "gain": 300
+}
+# Share of calories from protein, carbs, fat
+MACRO_SPLITS = {
+    "loss": (0.4, 0.3, 0.3),
+    "gain": (0.35, 0.45, 0.2),
+    "maintain": (0.3, 0.4, 0.3)
+}
+# Diets that fix their own split whatever the goal
+DIET_MACRO_SPLITS = {
+    "keto": (0.25, 0.05, 0.7)
+}
+DIET_PROFILE_DEFAULTS = {
+    "weight": 70,
+    "height": 175,
+    "age": 30,
+    "gender": "male",
+    "goal": "maintain",
+    "dietary_preference": "balanced",
+    "activity_level": "moderate"
+}
+# Accepted range of each numeric profile field in batch requests
+DIET_PROFILE_LIMITS = {
+    "weight": (20, 400),  # kg
+    "height": (50, 280),  # cm
+    "age": (1, 120)
+}
+
+def macro_split(goal, dietary_pref):
+    """Share of calories from (protein, carbs, fat)"""
+    return DIET_MACRO_SPLITS.get(dietary_pref) or MACRO_SPLITS.get(goal, MACRO_SPLITS["maintain"])
+
 def get_diet_recommendation(user_data):
     """Generate personalized diet plan based on user metrics"""
     weight = user_data.get("weight", 70)
@@ -310,77 +2440,44 @@ def get_diet_recommendation(user_data):
     
     # Calculate BMR and TDEE
     bmr = calculate_bmr(weight, height_cm, age, gender)
-    activity_multipliers = {
-        "sedentary": 1.2,
-        "light": 1.375,
-        "moderate": 1.55,
-        "active": 1.725,
-        "very_active": 1.9
-    }
-    tdee = bmr * activity_multipliers.get(activity_level, 1.55)
+    tdee = bmr * ACTIVITY_MULTIPLIERS.get(activity_level, 1.55)
     
     # Adjust calories based on goal
-    goal_adjustments = {
-        "loss": -500,
-        "maintain": 0,
-        "gain": 300
-    }
-    daily_calories = tdee + goal_adjustments.get(goal, 0)
+    daily_calories = tdee + GOAL_ADJUSTMENTS.get(goal, 0)
     
     # Macronutrient distribution
-    if goal == "loss":
-        macros = {"protein": 0.4, "carbs": 0.3, "fat": 0.3}
-    elif goal == "gain":
-        macros = {"protein": 0.35, "carbs": 0.45, "fat": 0.2}
-    else:
-        macros = {"protein": 0.3, "carbs": 0.4, "fat": 0.3}
-    
-    # Dietary preference adjustments
-    meal_plans = {
-        "balanced": {
-            "breakfast": "Oatmeal with berries and almonds, Greek yogurt",
-            "lunch": "Grilled chicken breast, quinoa, mixed vegetables",
-            "dinner": "Salmon, sweet potato, broccoli",
-            "snacks": "Apple with peanut butter, protein shake"
-        },
-        "vegetarian": {
-            "breakfast": "Tofu scramble with vegetables, whole grain toast",
-            "lunch": "Lentil soup, mixed salad with chickpeas",
-            "dinner": "Vegetable stir-fry with tofu and brown rice",
-            "snacks": "Greek yogurt, handful of nuts"
-        },
-        "vegan": {
-            "breakfast": "Chia seed pudding with fruits, almond milk",
-            "lunch": "Chickpea salad, vegetable soup",
-            "dinner": "Black bean burgers with sweet potato fries",
-            "snacks": "Hummus with vegetables, fruit smoothie"
-        },
-        "keto": {
-            "breakfast": "Avocado and eggs, bacon",
-            "lunch": "Chicken salad with olive oil dressing",
-            "dinner": "Steak with asparagus and butter",
-            "snacks": "Cheese cubes, almonds"
-        }
-    }
+    macros = dict(zip(("protein", "carbs", "fat"), macro_split(goal, dietary_pref)))
     
-    meal_plan = meal_plans.get(dietary_pref, meal_plans["balanced"])
-    
-    # Generate grocery list
-    grocery_list = generate_grocery_list(meal_plan, dietary_pref)
+    macronutrients = {
+        "protein_g": round(daily_calories * macros["protein"] / 4),
+        "carbs_g": round(daily_calories * macros["carbs"] / 4),
+        "fat_g": round(daily_calories * macros["fat"] / 9)
+    }
     
-    return {
+    result = {
         "bmi": bmi,
         "daily_calories": round(daily_calories),
-        "macronutrients": {
-            "protein_g": round(daily_calories * macros["protein"] / 4),
-            "carbs_g": round(daily_calories * macros["carbs"] / 4),
-            "fat_g": round(daily_calories * macros["fat"] / 9)
-        },
-        "meal_plan": meal_plan,
-        "grocery_list": grocery_list,
+        "macronutrients": macronutrients,
         "hydration": "2-3 liters of water daily",
         "recommendations": get_diet_recommendations(bmi, goal)
     }
+    
+    # Portions solved against the food table (cached per similar profile)
+    planner = get_meal_planner()
+    if planner:
+        plan = planner.plan(daily_calories, daily_calories * macros["protein"] / 4,
+                            daily_calories * macros["carbs"] / 4, daily_calories * macros["fat"] / 9, dietary_pref)
+        result["meal_plan"] = {meal: ", ".join(f"{name} ({grams} g)" for name, grams in items)
+                               for meal, items in plan["meals"].items()}
+        result["meal_portions"] = {meal: [{"food": name, "grams": grams} for name, grams in items]
+                                   for meal, items in plan["meals"].items()}
+        result["plan_totals"] = plan["totals"]
+        result["grocery_list"] = plan["grocery"]
+    else:
+        meal_plan = MEAL_PLANS.get(dietary_pref, MEAL_PLANS["balanced"])
+        result["meal_plan"] = meal_plan
+        result["grocery_list"] = generate_grocery_list(meal_plan, dietary_pref)
+    return result
 
 def generate_grocery_list(meal_plan, dietary_pref):
     base_items = [
@@ -401,6 +2498,59 @@ def generate_grocery_list(meal_plan, dietary_pref):
     
     return base_items
 
+def diet_targets_batch(profiles):
+    """BMI, calories and macro grams for many profiles at once.
+
+    The same formulas as get_diet_recommendation (calculate_bmi,
+    calculate_bmr, TDEE, goal adjustment, macro_split), evaluated column
+    by column over the whole batch. Raises ValueError naming the first
+    profile whose weight, height or age is not a number within
+    DIET_PROFILE_LIMITS, or whose other fields are not strings.
+    """
+    column = lambda key: [p.get(key, DIET_PROFILE_DEFAULTS[key]) for p in profiles]
+    
+    def numeric(key):
+        values = column(key)
+        low, high = DIET_PROFILE_LIMITS[key]
+        if {type(v) for v in values} <= {int, float}:
+            array = np.asarray(values, dtype=np.float64)
+            bad = np.flatnonzero(~np.isfinite(array) | (array < low) | (array > high))
+            if not len(bad):
+                return array
+            i = int(bad[0])
+        else:
+            i = next(i for i, v in enumerate(values) if type(v) not in (int, float))
+        raise ValueError(f"profile {i}: {key} must be a number from {low} to {high}, got {values[i]!r}")
+    
+    def categorical(key):
+        values = column(key)
+        for i, v in enumerate(values):
+            if not isinstance(v, str):
+                raise ValueError(f"profile {i}: {key} must be a string, got {v!r}")
+        return values
+    
+    weight, height_cm, age = numeric("weight"), numeric("height"), numeric("age")
+    male = np.array(categorical("gender")) == "male"
+    goals = categorical("goal")
+    
+    height_m = height_cm / 100
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bmi = np.where(height_m > 0, weight / height_m ** 2, 0)
+    bmr = 10 * weight + 6.25 * height_cm - 5 * age + np.where(male, 5, -161)
+    tdee = bmr * np.array([ACTIVITY_MULTIPLIERS.get(a, 1.55) for a in categorical("activity_level")])
+    daily_calories = tdee + np.array([GOAL_ADJUSTMENTS.get(goal, 0) for goal in goals])
+    splits = np.array([macro_split(goal, diet)
+                       for goal, diet in zip(goals, categorical("dietary_preference"))]).reshape(-1, 3)
+    grams = daily_calories[:, None] * splits / np.array([4, 4, 9])
+    return {
+        # Python's round for BMI so one decimal matches calculate_bmi exactly
+        "bmi": [round(x, 1) for x in bmi.tolist()],
+        "daily_calories": np.round(daily_calories).astype(np.int64).tolist(),
+        "protein_g": np.round(grams[:, 0]).astype(np.int64).tolist(),
+        "carbs_g": np.round(grams[:, 1]).astype(np.int64).tolist(),
+        "fat_g": np.round(grams[:, 2]).astype(np.int64).tolist()
+    }
+
 def get_diet_recommendations(bmi, goal):
     recommendations = []
     
@@ -423,35 +2573,29 @@ def get_diet_recommendations(bmi, goal):
     return recommendations
 
 # 3. AI FITNESS HABIT TRACKER
+NO_HABIT_DATA = {
+    "skip_probability": 0.5,
+    "next_workout_time": "Not enough data",
+    "motivation_level": 0.5,
+    "recommendations": ["Start tracking your workouts!"]
+}
+
 def analyze_workout_habits(user_data, client_id):
     """Analyze workout patterns and predict skip probability"""
     workout_history = user_data.get("workout_history", [])
     emotional_state = user_data.get("emotional_state", [])
     
     if not workout_history:
-        return {
-            "skip_probability": 0.5,
-            "next_workout_time": "Not enough data",
-            "motivation_level": 0.5,
-            "recommendations": ["Start tracking your workouts!"]
-        }
+        return dict(NO_HABIT_DATA)
     
-    # Calculate consistency
-    workouts_per_week = len([w for w in workout_history 
-                           if datetime.datetime.fromisoformat(w["timestamp"]).date() > 
-                           (datetime.datetime.now().date() - datetime.timedelta(days=7))])
+    workout_index = user_data["workout_index"]
     
-    # Analyze time patterns
-    workout_times = []
-    for workout in workout_history[-10:]:
-        dt = datetime.datetime.fromisoformat(workout["timestamp"])
-        workout_times.append(dt.hour)
+    # Calculate consistency
+    today = datetime.date.today().toordinal()
+    workouts_per_week = workout_index.totals_since(today - 6)[0]
     
-    # Most common workout time
-    if workout_times:
-        common_hour = max(set(workout_times), key=workout_times.count)
-    else:
-        common_hour = 18  # Default evening
+    # Most common workout time (default evening)
+    common_hour = workout_index.common_hour(default=18)
     
     # Calculate skip probability
     base_probability = 0.3
@@ -468,6 +2612,17 @@ def analyze_workout_habits(user_data, client_id):
     skip_probability = base_probability * (1.0 - consistency_factor * 0.5) + emotional_factor * 0.2
     skip_probability = max(0.1, min(0.9, skip_probability))
     
+    # Check for burnout
+    burnout = False
+    if len(workout_history) > 20:
+        recent_intensity = [w.get('intensity', 0.5) for w in workout_history[-5:]]
+        avg_intensity = sum(recent_intensity) / len(recent_intensity)
+        burnout = avg_intensity > 0.8
+    
+    return habit_report(skip_probability, consistency_factor, workouts_per_week, common_hour, burnout)
+
+def habit_report(skip_probability, consistency_factor, workouts_per_week, common_hour, burnout):
+    """habit_analysis response from the scored factors"""
     # Generate personalized recommendations
     recommendations = []
     if consistency_factor < 0.6:
@@ -477,12 +2632,8 @@ def analyze_workout_habits(user_data, client_id):
         recommendations.append("Schedule workouts at your peak energy times")
         recommendations.append("Try shorter, more frequent workouts")
     
-    # Check for burnout
-    if len(workout_history) > 20:
-        recent_intensity = [w.get('intensity', 0.5) for w in workout_history[-5:]]
-        avg_intensity = sum(recent_intensity) / len(recent_intensity)
-        if avg_intensity > 0.8:
-            recommendations.append("Consider active recovery or deload week")
+    if burnout:
+        recommendations.append("Consider active recovery or deload week")
     
     # Optimal next workout time
     hour_options = [(common_hour + i) % 24 for i in [0, -2, 2, -4, 4]]
@@ -520,10 +2671,174 @@ def get_motivational_nudge(skip_probability, consistency):
     else:
         return "Every workout counts. You're making progress!"
 
+def habit_histories():
+    """Every client's workouts and emotions, packed into flat arrays.
+
+    Rows come from the state store, plus clients only held in memory (the
+    memory store saves nothing). Returns (client_ids, workouts, emotions)
+    where workouts has columns client, time (datetime64), intensity and
+    emotions has client, sentiment score; each client's rows are
+    contiguous and oldest first.
+    """
+    store = get_state_store()
+    w_client, w_time, w_intensity = _columns(store.scan("workout", ("$.timestamp", "$.intensity")), 3)
+    e_client, e_score = _columns(store.scan("emotion", ("$[1]",)), 2)
+    saved = set(w_client).union(e_client)
+    
+    with USER_DATA._lock:
+        in_memory = [(cid, data) for cid, data in dict.items(USER_DATA) if cid not in saved]
+    for cid, data in in_memory:
+        history = data["workout_history"]
+        w_client += [cid] * len(history)
+        w_time += [w["timestamp"] for w in history]
+        w_intensity += [w.get("intensity") for w in history]
+        e_client += [cid] * len(data["emotional_state"])
+        e_score += [e[1] for e in data["emotional_state"]]
+    
+    members = w_client + e_client + [cid for cid, _ in in_memory]
+    client_ids, client = np.unique(np.array(members, dtype=object).astype(str), return_inverse=True)
+    intensity = np.array(w_intensity, dtype=np.float64)  # missing (None) -> nan
+    workouts = {
+        "client": client[:len(w_client)],
+        "time": np.array(w_time, dtype="datetime64[us]"),
+        "intensity": np.where(np.isnan(intensity), 0.5, intensity)
+    }
+    emotions = {
+        "client": client[len(w_client):len(w_client) + len(e_client)],
+        "score": np.array(e_score, dtype=np.float64)
+    }
+    return client_ids.tolist(), workouts, emotions
+
+def _columns(rows, n):
+    return [list(column) for column in zip(*rows)] or [[] for _ in range(n)]
+
+def _group_rank(client, n_clients):
+    """(stable order grouping rows by client, rows per client, position of
+    each ordered row counted from its client's newest row)"""
+    order = np.argsort(client, kind="stable")
+    counts = np.bincount(client, minlength=n_clients)
+    ends = np.cumsum(counts)
+    from_end = ends[client[order]] - np.arange(len(order)) - 1
+    return order, counts, from_end
+
+def score_habits(client_ids, workouts, emotions, today=None):
+    """analyze_workout_habits for every client at once.
+
+    Same factors as the per-client version, computed in whole-population
+    NumPy passes: the weekly count and the last-10 hour histogram come from
+    bincounts, the last 3 sentiments and last 5 intensities from each row's
+    rank within its client. Returns a dict of per-client columns.
+    """
+    n = len(client_ids)
+    if today is None:
+        today = datetime.date.today()
+    today = np.datetime64(today, "D")
+    
+    order, n_workouts, from_end = _group_rank(workouts["client"], n)
+    client = workouts["client"][order]
+    when = workouts["time"][order]
+    day = when.astype("datetime64[D]")
+    hour = ((when - day) // np.timedelta64(1, "h")).astype(np.int64)
+    
+    workouts_per_week = np.bincount(client[day > today - 7], minlength=n)
+    recent = from_end < WORKOUT_HOUR_WINDOW
+    hours = np.bincount(client[recent] * 24 + hour[recent], minlength=n * 24).reshape(n, 24)
+    common_hour = np.where(n_workouts > 0, hours.argmax(axis=1), 18)
+    
+    recent = from_end < 5
+    intensity = np.bincount(client[recent], weights=workouts["intensity"][order][recent], minlength=n)
+    burnout = (n_workouts > 20) & (intensity / np.maximum(np.minimum(n_workouts, 5), 1) > 0.8)
+    
+    order, n_emotions, from_end = _group_rank(emotions["client"], n)
+    recent = from_end < 3
+    sentiment = np.bincount(emotions["client"][order][recent], weights=emotions["score"][order][recent], minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        emotional_factor = np.where(n_emotions > 0, 1.0 - sentiment / np.minimum(n_emotions, 3), 0.5)
+    
+    consistency_factor = np.minimum(1.0, workouts_per_week / 5)
+    skip_probability = np.clip(0.3 * (1.0 - consistency_factor * 0.5) + emotional_factor * 0.2, 0.1, 0.9)
+    return {
+        "client_id": client_ids,
+        "workouts": n_workouts,
+        "workouts_per_week": workouts_per_week,
+        "common_hour": common_hour,
+        "burnout": burnout,
+        "consistency_factor": consistency_factor,
+        "skip_probability": skip_probability
+    }
+
+class HabitScores:
+    """Latest batch of habit scores, served by /api/habit_analysis.
+
+    A client's row is dropped as soon as it logs a workout or an emotion,
+    and the whole batch stops being served once the day it was computed
+    for is over (the weekly window has moved), so a hit always matches
+    what analyze_workout_habits would return.
+    """
+    
+    def __init__(self):
+        self.day = None
+        self.columns = {}
+        self.rows = {}
+        self.hits = 0
+        self.misses = 0
+        self._changed = None  # clients invalidated while a refresh is reading histories
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+    
+    def refresh(self):
+        """Score every client; {"clients": n, "seconds": elapsed}"""
+        with self._refresh_lock:
+            start = time.perf_counter()
+            day = datetime.date.today()
+            with self._lock:
+                self._changed = set()
+            columns = score_habits(*habit_histories(), today=day)
+            with self._lock:
+                rows = {cid: i for i, cid in enumerate(columns["client_id"])}
+                for client_id in self._changed:
+                    rows.pop(client_id, None)
+                self._changed = None
+                self.day, self.columns, self.rows = day, columns, rows
+            return {"clients": len(columns["client_id"]), "seconds": round(time.perf_counter() - start, 3)}
+    
+    def invalidate(self, client_id):
+        with self._lock:
+            self.rows.pop(client_id, None)
+            if self._changed is not None:
+                self._changed.add(client_id)
+    
+    def report(self, client_id):
+        """Cached habit_analysis response, or None if the client must be scored live"""
+        with self._lock:
+            row = self.rows.get(client_id) if self.day == datetime.date.today() else None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            c = self.columns
+        if not c["workouts"][row]:
+            return dict(NO_HABIT_DATA)
+        return habit_report(float(c["skip_probability"][row]), float(c["consistency_factor"][row]),
+                            int(c["workouts_per_week"][row]), int(c["common_hour"][row]), bool(c["burnout"][row]))
+    
+    def summary(self, client_ids):
+        """Skip probability and recommended workout time of the given clients in the latest batch"""
+        with self._lock:
+            c = self.columns
+            rows = [(cid, self.rows[cid]) for cid in dict.fromkeys(client_ids) if cid in self.rows]
+        return [{
+            "client_id": cid,
+            "skip_probability": round(float(c["skip_probability"][i]) * 100) if c["workouts"][i] else None,
+            "optimal_workout_time": f"{int(c['common_hour'][i])}:00" if c["workouts"][i] else None
+        } for cid, i in rows]
+
+HABIT_SCORES = HabitScores()
+
 # 4. VIRTUAL GYM BUDDY (AI Chat Companion)
 class VirtualGymBuddy:
     def __init__(self):
-        self.conversation_history = defaultdict(list)
+        self.conversation_history = ClientStateCache(list, restore=restore_chat_history)
         self.personality_traits = {
             "motivational": 0.8,
             "technical": 0.6,
@@ -533,11 +2848,7 @@ class VirtualGymBuddy:
     
     def respond(self, client_id, user_message):
         # Store conversation
-        self.conversation_history[client_id].append({
-            "role": "user",
-            "message": user_message,
-            "timestamp": datetime.datetime.now().isoformat()
-        })
+        self.add_message(client_id, "user", user_message)
         
         # Analyze sentiment
         sentiment, score = analyze_sentient(user_message)
@@ -555,15 +2866,11 @@ class VirtualGymBuddy:
             response = self.get_general_response(sentiment)
         
         # Store bot response
-        self.conversation_history[client_id].append({
-            "role": "bot",
-            "message": response,
-            "timestamp": datetime.datetime.now().isoformat()
-        })
+        self.add_message(client_id, "bot", response)
         
         # Limit conversation history
-        if len(self.conversation_history[client_id]) > 20:
-            self.conversation_history[client_id] = self.conversation_history[client_id][-20:]
+        if len(self.conversation_history[client_id]) > CHAT_HISTORY_SIZE:
+            self.conversation_history[client_id] = self.conversation_history[client_id][-CHAT_HISTORY_SIZE:]
         
         return {
             "response": response,
@@ -572,6 +2879,15 @@ class VirtualGymBuddy:
             "suggested_topics": self.get_suggested_topics(client_id)
         }
     
+    def add_message(self, client_id, role, message):
+        entry = {
+            "role": role,
+            "message": message,
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+        self.conversation_history[client_id].append(entry)
+        get_state_store().append(client_id, "chat", entry)
+    
     def get_motivational_response(self, sentiment):
         if sentiment == "negative":
             responses = [
@@ -646,108 +2962,74 @@ gym_buddy = VirtualGymBuddy()
 # 5. GYM RECOMMENDER & PLANNER
 def recommend_gyms(location, preferences, client_id):
     """Recommend gyms based on location and preferences"""
-    # Mock data - in production, integrate with Google Places API or similar
-    gym_database = [
-        {
-            "name": "Fitness First Premium",
-            "address": "123 Fitness St, " + location,
-            "rating": 4.8,
-            "price_range": "$$$",
-            "features": ["24/7 access", "Pool", "Sauna", "Group classes", "Personal trainers"],
-            "distance": "0.8 miles",
-            "specialties": ["Strength training", "Cardio", "Yoga"],
-            "membership_fee": "$99/month"
-        },
-        {
-            "name": "Anytime Fitness",
-            "address": "456 Workout Ave, " + location,
-            "rating": 4.5,
-            "price_range": "$$",
-            "features": ["24/7 access", "Basic equipment", "Virtual classes"],
-            "distance": "1.2 miles",
-            "specialties": ["Convenience", "Basic fitness"],
-            "membership_fee": "$49/month"
-        },
-        {
-            "name": "CrossFit Box",
-            "address": "789 Intensity Rd, " + location,
-            "rating": 4.9,
-            "price_range": "$$$$",
-            "features": ["CrossFit classes", "Open gym", "Community events"],
-            "distance": "2.1 miles",
-            "specialties": ["CrossFit", "High-intensity training"],
-            "membership_fee": "$150/month"
-        },
-        {
-            "name": "Planet Fitness",
-            "address": "101 Beginner Blvd, " + location,
-            "rating": 4.2,
-            "price_range": "$",
-            "features": ["Judgement free zone", "Massage chairs", "Tanning"],
-            "distance": "0.5 miles",
-            "specialties": ["Beginner friendly", "Cardio"],
-            "membership_fee": "$10/month"
-        },
-        {
-            "name": "Equinox Luxury",
-            "address": "202 Luxury Ln, " + location,
-            "rating": 4.7,
-            "price_range": "$$$$$",
-            "features": ["Luxury amenities", "Spa", "Restaurant", "Pool", "Basketball court"],
-            "distance": "3.0 miles",
-            "specialties": ["Luxury fitness", "Holistic wellness"],
-            "membership_fee": "$250/month"
-        }
-    ]
-    
-    # Filter based on preferences
-    filtered_gyms = gym_database
-    
-    if preferences.get("budget"):
-        budget_map = {"$": 1, "$$": 2, "$$$": 3, "$$$$": 4, "$$$$$": 5}
-        user_budget = preferences.get("budget", 3)
-        filtered_gyms = [g for g in filtered_gyms if budget_map.get(g["price_range"], 3) <= user_budget]
-    
-    if preferences.get("features"):
-        desired_features = preferences["features"]
-        filtered_gyms = [g for g in filtered_gyms if any(feat in g["features"] for feat in desired_features)]
-    
-    if preferences.get("specialties"):
-        desired_specialties = preferences["specialties"]
-        filtered_gyms = [g for g in filtered_gyms if any(spec in g["specialties"] for spec in desired_specialties)]
-    
-    # Sort by rating and distance
-    filtered_gyms.sort(key=lambda x: (x["rating"], -float(x["distance"].split()[0])), reverse=True)
-    
-    # Get user history for personalized recommendations
-    user_data = USER_DATA[client_id]
+    intensity = workout_intensity(USER_DATA.lookup(client_id) or EMPTY_USER_DATA)
+    return with_recommended_classes(find_gyms(location, preferences, intensity))
+
+def workout_intensity(user_data):
+    """Intensity class, "high", "low" or None, of the last 10 logged workouts"""
     workout_history = user_data.get("workout_history", [])
-    
     if workout_history:
         # Analyze workout patterns for better recommendations
         intensity_levels = [w.get('intensity', 0.5) for w in workout_history[-10:]]
         avg_intensity = sum(intensity_levels) / len(intensity_levels) if intensity_levels else 0.5
         
         if avg_intensity > 0.7:
-            # High intensity preference
-            filtered_gyms = [g for g in filtered_gyms if "High-intensity" in g["specialties"] or "CrossFit" in g["name"]]
+            return "high"  # High-intensity specialty or a CrossFit gym
         elif avg_intensity < 0.3:
-            # Low intensity preference
-            filtered_gyms = [g for g in filtered_gyms if "Beginner" in g["specialties"] or "Yoga" in g["specialties"]]
-    
-    # Generate workout plan based on selected gym
-    workout_plan = generate_workout_plan(filtered_gyms[0] if filtered_gyms else gym_database[0], preferences)
+            return "low"  # Beginner or Yoga specialty
+    return None
+
+def with_recommended_classes(result):
+    if result["workout_plan"] is None:
+        return result
+    plan = dict(result["workout_plan"], recommended_classes=random.sample(["Yoga", "Spin", "Zumba", "Bootcamp", "Pilates"], 3))
+    return dict(result, workout_plan=plan)
+
+def find_gyms(location, preferences, intensity):
+    """recommend_gyms without the random class picks: a pure function of its inputs"""
+    catalog = get_gym_catalog()
+    
+    # Search around the requested city or coordinates
+    center = catalog.locate(location, preferences.get("lat"), preferences.get("lon"))
+    if center is None:
+        return no_gyms("unknown_location", f"Unknown location {location!r}: use a city from "
+                                           f"{os.path.basename(CITY_TABLE_PATH)} or \"lat,lon\"")
+    radius_km = float(preferences.get("radius") or GYM_DEFAULT_RADIUS_MILES) * KM_PER_MILE
+    
+    # Filter on budget/features/specialties, rank by rating then distance
+    top, in_range, nearest = catalog.search(
+        *center, radius_km,
+        budget=preferences.get("budget"),
+        features=preferences.get("features"),
+        specialties=preferences.get("specialties"),
+        intensity=intensity)
+    if nearest is None:
+        return no_gyms("no_gyms_in_range", f"No gyms within {radius_km / KM_PER_MILE:g} miles of {location}")
+    recommended = [catalog.gym(i, km) for i, km in top]
+    
+    # Generate workout plan based on the top pick, else the nearest gym in range
+    workout_plan = generate_workout_plan(recommended[0] if recommended else catalog.gym(*nearest), preferences)
     
     return {
-        "recommended_gyms": filtered_gyms[:5],
+        "recommended_gyms": recommended,
         "workout_plan": workout_plan,
         "comparison_metrics": {
-            "total_gyms_analyzed": len(gym_database),
-            "best_value": min(filtered_gyms, key=lambda x: x.get("price_score", 3))["name"] if filtered_gyms else "N/A",
-            "closest": min(gym_database, key=lambda x: float(x["distance"].split()[0]))["name"]
+            "total_gyms_analyzed": in_range,
+            "best_value": recommended[0]["name"] if recommended else "N/A",
+            "closest": catalog.rows[nearest[0]]["name"]
         }
     }
 
+def no_gyms(reason, message):
+    """Gym finder response when there is nothing to recommend or plan around"""
+    return {
+        "recommended_gyms": [],
+        "workout_plan": None,
+        "comparison_metrics": {"total_gyms_analyzed": 0, "best_value": "N/A", "closest": "N/A"},
+        "reason": reason,
+        "message": message
+    }
+
 def generate_workout_plan(gym, preferences):
     """Generate personalized workout plan based on gym features"""
     days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
@@ -783,7 +3065,6 @@ def generate_workout_plan(gym, preferences):
     return {
         "weekly_schedule": plan,
         "focus_areas": gym["specialties"],
-        "recommended_classes": random.sample(["Yoga", "Spin", "Zumba", "Bootcamp", "Pilates"], 3),
         "progress_tracking": "Track: Strength gains, Endurance improvement, Consistency"
     }
 
@@ -807,6 +3088,29 @@ def serve_js():
 # 1. Squat Counter API
 @app.route("/api/predict", methods=["POST"])
 def predict():
+    mimetype = request.mimetype
+    
+    # Binary upload: raw JPEG/PNG body or multipart "image" field
+    if mimetype == "application/octet-stream" or mimetype.startswith("image/"):
+        buf = request.get_data(cache=False)
+        cid = request_client_id()
+        exercise = request_exercise()
+    elif mimetype == "multipart/form-data":
+        upload = request.files.get("image")
+        buf = upload.read() if upload else b""
+        cid = request.form.get("client_id") or request_client_id()
+        exercise = request.form.get("exercise") or request_exercise()
+    else:
+        buf = None
+    
+    if buf is not None:
+        if not buf:
+            return jsonify({"ok": False, "reason": "no_image"}), 400
+        img = decode_image_bytes(buf)
+        if img is None:
+            return jsonify({"ok": False, "reason": "bad_image"}), 400
+        return jsonify(squat_counter(img, cid, exercise))
+    
     data = request.get_json(force=True)
 
     if "image" not in data:
@@ -816,11 +3120,200 @@ def predict():
         img = decode_b64_image(data["image"])
     except:
         return jsonify({"ok": False, "reason": "bad_image"}), 400
+    if img is None:
+        return jsonify({"ok": False, "reason": "bad_image"}), 400
 
     cid = data.get("client_id", "default")
-    result = squat_counter(img, cid)
+    result = squat_counter(img, cid, data.get("exercise", "squat"))
+    return jsonify(result)
+
+# 1b. Squat Counter stream (one WebSocket per client)
+def serve_latest_frames(ws, handle):
+    """Answer each binary message on `ws` with handle(message) as JSON.
+
+    Frames that arrive while one is being processed are not queued: only
+    the newest is kept and the rest are counted in "dropped" so the
+    client can release its in-flight budget.
+    """
+    while True:
+        frame = ws.receive()
+        if frame is None:
+            break
+        
+        # Latest frame wins
+        dropped = 0
+        while True:
+            newer = ws.receive(timeout=0)
+            if newer is None:
+                break
+            frame = newer
+            dropped += 1
+        
+        result = handle(frame)
+        result["dropped"] = dropped
+        ws.send(json.dumps(result))
+
+def predict_frame(frame, cid, exercise):
+    """One streamed JPEG/PNG frame -> result dict"""
+    # cv2.imdecode raises on an empty buffer rather than returning None
+    img = decode_image_bytes(frame) if isinstance(frame, bytes) and frame else None
+    if img is None:
+        return {"ok": False, "reason": "bad_image"}
+    return squat_counter(img, cid, exercise)
+
+def landmarks_frame(frame, cid, exercise, w, h):
+    """One streamed packed landmark array -> result dict"""
+    landmarks = unpack_landmarks(frame) if isinstance(frame, bytes) else None
+    if landmarks is None:
+        return {"ok": False, "reason": "bad_landmarks"}
+    with timed("count_reps"):
+        return count_reps(landmarks, w, h, cid, exercise)
+
+def stream_predict(ws):
+    """Binary JPEG/PNG frames in, JSON results out"""
+    cid = request.args.get("client_id", "default")
+    exercise = request.args.get("exercise", "squat")
+    serve_latest_frames(ws, lambda frame: predict_frame(frame, cid, exercise))
+
+def stream_landmarks(ws):
+    """Packed float32 landmark arrays in, JSON results out"""
+    cid = request.args.get("client_id", "default")
+    exercise = request.args.get("exercise", "squat")
+    size = request_frame_size()
+    if size is None:
+        ws.close(1008, "width and height must be positive numbers")
+        return
+    w, h = size
+    serve_latest_frames(ws, lambda frame: landmarks_frame(frame, cid, exercise, w, h))
+
+if sock:
+    sock.route("/ws/predict")(stream_predict)
+    sock.route("/ws/landmarks")(stream_landmarks)
+
+# 1c. Landmark ingestion (pose already run on the client)
+@app.route("/api/landmarks", methods=["POST"])
+def ingest_landmarks():
+    """Rep counting from client-side pose, no image decode or inference.
+
+    Body is either 528 bytes of little-endian float32 (33 landmarks x
+    x, y, z, visibility, normalized like MediaPipe) with client_id,
+    exercise, width and height in headers/query, or JSON
+    {"landmarks": [[x, y, z, v], ...], "client_id", "exercise", "width", "height"}.
+    """
+    if request.mimetype == "application/octet-stream":
+        landmarks = unpack_landmarks(request.get_data(cache=False))
+        cid = request_client_id()
+        exercise = request_exercise()
+        size = request_frame_size()
+    else:
+        data = request.get_json(force=True)
+        landmarks = landmarks_from_list(data.get("landmarks"))
+        cid = data.get("client_id", "default")
+        exercise = data.get("exercise", "squat")
+        size = parse_frame_size(data.get("width", DEFAULT_FRAME_SIZE[0]), data.get("height", DEFAULT_FRAME_SIZE[1]))
+    
+    if landmarks is None:
+        return jsonify({"ok": False, "reason": "bad_landmarks"}), 400
+    if size is None:
+        return jsonify({"ok": False, "reason": "bad_frame_size",
+                        "message": "width and height must be positive numbers"}), 400
+    w, h = size
+    with timed("count_reps"):
+        result = count_reps(landmarks, w, h, cid, exercise)
     return jsonify(result)
 
+# 1d. Pose inference stats (queue depth, per-worker throughput)
+@app.route("/api/inference_stats", methods=["GET"])
+def inference_stats():
+    shared = get_shared_rep_state()
+    shared_stats = shared.stats() if shared else None
+    service = get_inference_service()
+    if service:
+        return jsonify(dict(service.stats(), motion_gate=motion_gate_stats(), shared_state=shared_stats))
+    pose_pool = get_pose_pool()
+    return jsonify({
+        "mode": "inline",
+        "pose_pool": pose_pool.stats() if pose_pool else None,
+        "motion_gate": motion_gate_stats(),
+        "shared_state": shared_stats
+    })
+
+# 1e. Prometheus metrics (stage/route latency, store sizes)
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    lines = []
+    _prom_histogram(lines, "fitness_stage_latency_seconds", "Time spent in each frame processing stage",
+                    STAGE_LATENCY, ("stage",))
+    _prom_histogram(lines, "fitness_route_latency_seconds", "API request latency by route",
+                    ROUTE_LATENCY, ("route", "method"))
+    _prom_metric(lines, "fitness_route_requests_total", "counter", "API requests by route and status",
+                 [(dict(route=r, method=m, status=c), n) for (r, m, c), n in sorted(ROUTE_STATUS.items())])
+    
+    conversations = gym_buddy.conversation_history
+    _prom_metric(lines, "fitness_live_clients", "gauge", "Clients with live rep counting state",
+                 [({}, len(CLIENTS))])
+    _prom_metric(lines, "fitness_user_data_clients", "gauge", "Clients in USER_DATA", [({}, len(USER_DATA))])
+    _prom_metric(lines, "fitness_chat_conversations", "gauge", "Clients with chat history",
+                 [({}, len(conversations))])
+    _prom_metric(lines, "fitness_chat_messages", "gauge", "Chat messages held in memory",
+                 [({}, sum(len(history) for history in list(conversations.values())))])
+    
+    caches = (("clients", CLIENTS), ("user_data", USER_DATA), ("chat", conversations))
+    for key, kind, help_text in (("hits", "counter", "Client state cache hits"),
+                                 ("misses", "counter", "Client state cache misses (created or reloaded)"),
+                                 ("evictions", "counter", "Client state evicted by size or idle TTL")):
+        _prom_metric(lines, f"fitness_client_cache_{key}_total", kind, help_text,
+                     [(dict(cache=name), getattr(cache, key)) for name, cache in caches])
+    
+    results = RESULT_CACHE.stats()["namespaces"]
+    planner, habits = get_meal_planner(), HABIT_SCORES
+    for key, help_text in (("hits", "Result cache hits"), ("misses", "Result cache misses (computed)"),
+                           ("not_modified", "Responses answered 304 Not Modified")):
+        _prom_metric(lines, f"fitness_result_cache_{key}_total", "counter", help_text,
+                     [(dict(cache=ns), s[key]) for ns, s in results.items()])
+    ratios = [(dict(cache=ns), s["hit_ratio"]) for ns, s in results.items()]
+    if planner:
+        ratios.append((dict(cache="meal_plan"), planner.stats()["hit_ratio"]))
+    if habits.hits + habits.misses:
+        ratios.append((dict(cache="habit_scores"), round(habits.hits / (habits.hits + habits.misses), 3)))
+    ratios += [(dict(cache=name), cache.stats()["hit_ratio"]) for name, cache in caches]
+    _prom_metric(lines, "fitness_cache_hit_ratio", "gauge", "Hit ratio per cache since startup", ratios)
+    _prom_metric(lines, "fitness_result_cache_entries", "gauge", "Responses held in the result cache",
+                 [({}, len(RESULT_CACHE))])
+    
+    store = get_state_store().stats()
+    if "pending" in store:
+        _prom_metric(lines, "fitness_store_pending_writes", "gauge", "State writes waiting for the flush thread",
+                     [({}, store["pending"])])
+        _prom_metric(lines, "fitness_store_flushed_writes_total", "counter", "State writes flushed to disk",
+                     [({}, store["flushed"])])
+    
+    gate = motion_gate_stats()
+    _prom_metric(lines, "fitness_motion_gate_frames_total", "counter", "Frames seen by the motion gate",
+                 [({}, gate["frames"])])
+    _prom_metric(lines, "fitness_motion_gate_skipped_total", "counter", "Frames answered from cache",
+                 [({}, gate["skipped"])])
+    
+    service = get_inference_service()
+    if service:
+        workers = service.stats()["workers"]
+        for key, kind, help_text in (("queue_depth", "gauge", "Frames waiting for a pose worker"),
+                                     ("processed", "counter", "Frames processed by a pose worker"),
+                                     ("dropped", "counter", "Frames dropped from a full client queue"),
+                                     ("restarts", "counter", "Pose worker restarts")):
+            name = f"fitness_inference_{key}" + ("_total" if kind == "counter" else "")
+            _prom_metric(lines, name, kind, help_text, [(dict(worker=w["worker"]), w[key]) for w in workers])
+    else:
+        pose_pool = get_pose_pool()
+        if pose_pool:
+            pool = pose_pool.stats()
+            _prom_metric(lines, "fitness_pose_pool_roi_frames_total", "counter", "Frames run on a tracked crop",
+                         [({}, pool["roi_frames"])])
+            _prom_metric(lines, "fitness_pose_pool_full_frames_total", "counter", "Frames run on the full frame",
+                         [({}, pool["full_frames"])])
+    
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 # 2. Diet Recommendation API
 @app.route("/api/diet_recommendation", methods=["POST"])
 def diet_recommendation():
@@ -828,18 +3321,61 @@ def diet_recommendation():
     client_id = data.get("client_id", "default")
     
     # Store user preferences
-    USER_DATA[client_id]["diet_preferences"] = {
-        "weight": data.get("weight", 70),
-        "height": data.get("height", 175),
-        "age": data.get("age", 30),
-        "gender": data.get("gender", "male"),
-        "goal": data.get("goal", "maintain"),
-        "dietary_preference": data.get("dietary_preference", "balanced"),
-        "activity_level": data.get("activity_level", "moderate")
-    }
+    with client_lock(client_id):
+        USER_DATA[client_id]["diet_preferences"] = {
+            "weight": data.get("weight", 70),
+            "height": data.get("height", 175),
+            "age": data.get("age", 30),
+            "gender": data.get("gender", "male"),
+            "goal": data.get("goal", "maintain"),
+            "dietary_preference": data.get("dietary_preference", "balanced"),
+            "activity_level": data.get("activity_level", "moderate")
+        }
+        get_state_store().put(client_id, "diet_preferences", USER_DATA[client_id]["diet_preferences"])
     
-    recommendation = get_diet_recommendation(USER_DATA[client_id]["diet_preferences"])
-    return jsonify(recommendation)
+    preferences = USER_DATA[client_id]["diet_preferences"]
+    return cached_response("diet", preferences, lambda: get_diet_recommendation(preferences))
+
+@app.route("/api/diet_recommendation/batch", methods=["POST"])
+def diet_recommendation_batch():
+    """Targets for many members in one call (cohort onboarding).
+
+    Body: a JSON list of profiles (the /api/diet_recommendation fields plus
+    client_id), or NDJSON with one profile per line. A JSON list gets one
+    columnar JSON object back; NDJSON gets one result line per member.
+    """
+    ndjson = request.mimetype in ("application/x-ndjson", "application/jsonl")
+    try:
+        if ndjson:
+            profiles = [json.loads(line) for line in request.get_data(cache=False).splitlines() if line.strip()]
+        else:
+            profiles = request.get_json(force=True)
+        if not isinstance(profiles, list) or not all(isinstance(p, dict) for p in profiles):
+            raise ValueError("expected a list of profile objects")
+        targets = diet_targets_batch(profiles)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid batch: {e}"}), 400
+    
+    client_ids = [str(p.get("client_id", "default")) for p in profiles]
+    
+    # Store preferences in one pass. Members not held in memory are only
+    # written to the store; their entry picks the preferences up when loaded.
+    store = get_state_store()
+    for client_id, profile in zip(client_ids, profiles):
+        preferences = {key: profile.get(key, default) for key, default in DIET_PROFILE_DEFAULTS.items()}
+        store.put(client_id, "diet_preferences", preferences)
+        if not store.durable or client_id in USER_DATA:
+            with client_lock(client_id):
+                USER_DATA[client_id]["diet_preferences"] = preferences
+    
+    if not ndjson:
+        return jsonify(dict(targets, client_id=client_ids, count=len(client_ids)))
+    
+    keys = list(targets)
+    def lines():
+        for client_id, row in zip(client_ids, zip(*targets.values())):
+            yield json.dumps(dict(zip(keys, row), client_id=client_id)) + "\n"
+    return Response(lines(), mimetype="application/x-ndjson")
 
 # 3. Habit Tracker API
 @app.route("/api/habit_analysis", methods=["POST"])
@@ -858,12 +3394,32 @@ def habit_analysis():
             "reps": data["workout_data"].get("reps", 0),
             "score": data["workout_data"].get("score", 0)
         }
-        USER_DATA[client_id]["workout_history"].append(workout_data)
-    
-    # Analyze habits
-    analysis = analyze_workout_habits(USER_DATA[client_id], client_id)
+        with client_lock(client_id):
+            record_workout(USER_DATA[client_id], workout_data)
+            get_state_store().append(client_id, "workout", workout_data)
+            HABIT_SCORES.invalidate(client_id)
+    
+    # Analyze habits (served from the nightly batch while it is current)
+    analysis = HABIT_SCORES.report(client_id)
+    if analysis is None:
+        with client_lock(client_id):
+            analysis = analyze_workout_habits(USER_DATA.lookup(client_id) or EMPTY_USER_DATA, client_id)
     return jsonify(analysis)
 
+@app.route("/api/habit_scores", methods=["POST"])
+def habit_scores():
+    """Score every client's habits in one batch (run nightly).
+
+    Only the scores of the clients listed in {"client_ids": [...]} are
+    returned; the endpoint never lists who else is in the system.
+    """
+    data = request.get_json(silent=True) or {}
+    client_ids = data.get("client_ids", [])
+    if not isinstance(client_ids, list) or not all(isinstance(cid, str) for cid in client_ids):
+        return jsonify({"error": "client_ids must be a list of strings"}), 400
+    result = HABIT_SCORES.refresh()
+    return jsonify(dict(result, scores=HABIT_SCORES.summary(client_ids)))
+
 # 4. Gym Buddy Chat API
 @app.route("/api/chat", methods=["POST"])
 def chat():
@@ -873,14 +3429,19 @@ def chat():
     
     # Store emotional state if provided
     if data.get("sentiment"):
-        USER_DATA[client_id]["emotional_state"].append((
+        emotion = (
             data["sentiment"],
             data.get("sentiment_score", 0.5),
             datetime.datetime.now().isoformat()
-        ))
+        )
+        with client_lock(client_id):
+            USER_DATA[client_id]["emotional_state"].append(emotion)
+            get_state_store().append(client_id, "emotion", emotion)
+            HABIT_SCORES.invalidate(client_id)
     
     # Get response from gym buddy
-    response = gym_buddy.respond(client_id, message)
+    with client_lock(client_id):
+        response = gym_buddy.respond(client_id, message)
     return jsonify(response)
 
 # 5. Performance Analysis API
@@ -889,10 +3450,10 @@ def performance_analysis():
     data = request.get_json()
     client_id = data.get("client_id", "default")
     
-    user_data = USER_DATA[client_id]
-    performance_scores = user_data.get("performance_scores", [])
+    user_data = USER_DATA.lookup(client_id) or EMPTY_USER_DATA
+    stats = user_data["performance_scores"]
     
-    if not performance_scores:
+    if len(stats) == 0:
         return jsonify({
             "overall_score": 0,
             "weekly_trend": "No data",
@@ -902,11 +3463,7 @@ def performance_analysis():
             "recommendations": ["Start tracking your workouts!"]
         })
     
-    recent_scores = performance_scores[-7:] if len(performance_scores) >= 7 else performance_scores
-    older_scores = performance_scores[:-7] if len(performance_scores) >= 14 else performance_scores[:len(performance_scores)//2]
-    
-    avg_recent = sum(recent_scores) / len(recent_scores) if recent_scores else 0
-    avg_older = sum(older_scores) / len(older_scores) if older_scores else 0
+    avg_recent, avg_older = stats.averages()
     
     improvement = round(((avg_recent - avg_older) / avg_older * 100) if avg_older > 0 else 0, 1)
     
@@ -916,18 +3473,18 @@ def performance_analysis():
     elif avg_recent > 85:
         recommendations.append("Great progress! Consider increasing workout difficulty")
     
-    if len(recent_scores) < 3:
+    if len(stats) < 3:
         recommendations.append("Track more workouts for better analysis")
     
     return jsonify({
         "overall_score": round(avg_recent),
         "weekly_trend": "↑ Improving" if improvement > 0 else "↓ Declining" if improvement < 0 else "→ Stable",
         "average_score": round(avg_recent),
-        "best_score": max(performance_scores) if performance_scores else 0,
+        "best_score": stats.best,
         "improvement": improvement,
-        "total_sessions": len(performance_scores),
+        "total_sessions": len(stats),
         "recommendations": recommendations,
-        "score_history": performance_scores[-10:]  # Last 10 scores
+        "score_history": stats.view(10).tolist()  # Last 10 scores
     })
 
 # 6. Gym Recommendation API
@@ -936,21 +3493,33 @@ def gym_recommendations():
     data = request.get_json()
     client_id = data.get("client_id", "default")
     
-    # Store gym preferences
-    USER_DATA[client_id]["gym_preferences"] = {
-        "location": data.get("location", "New York"),
-        "budget": data.get("budget", 3),
-        "features": data.get("features", ["24/7", "pool"]),
-        "specialties": data.get("specialties", [])
-    }
-    
-    recommendations = recommend_gyms(
-        data.get("location", "New York"),
-        USER_DATA[client_id]["gym_preferences"],
-        client_id
-    )
+    try:
+        radius, lat, lon = parse_gym_search_area(data)
+    except ValueError as e:
+        return jsonify({"ok": False, "reason": "bad_search_area", "message": str(e)}), 400
     
-    return jsonify(recommendations)
+    # Store gym preferences
+    with client_lock(client_id):
+        USER_DATA[client_id]["gym_preferences"] = {
+            "location": data.get("location", "New York"),
+            "budget": data.get("budget", 3),
+            "features": data.get("features", ["24/7", "pool"]),
+            "specialties": data.get("specialties", []),
+            "radius": radius,
+            "lat": lat,
+            "lon": lon
+        }
+        get_state_store().put(client_id, "gym_preferences", USER_DATA[client_id]["gym_preferences"])
+    
+    location = data.get("location", "New York")
+    preferences = dict(USER_DATA[client_id]["gym_preferences"])
+    for key in ("features", "specialties"):
+        if isinstance(preferences.get(key), list):
+            preferences[key] = sorted(preferences[key])  # "any of" filters: order doesn't matter
+    # Personalized only through the workout intensity class, which is part of the key
+    intensity = workout_intensity(USER_DATA.lookup(client_id) or EMPTY_USER_DATA)
+    return cached_response("gym", {"location": location, "preferences": preferences, "intensity": intensity},
+                           lambda: find_gyms(location, preferences, intensity), finish=with_recommended_classes)
 
 # 7. User Dashboard API
 @app.route("/api/dashboard_data", methods=["POST"])
@@ -958,33 +3527,19 @@ def dashboard_data():
     data = request.get_json()
     client_id = data.get("client_id", "default")
     
-    user_data = USER_DATA[client_id]
+    user_data = USER_DATA.lookup(client_id) or EMPTY_USER_DATA
     
-    # Calculate weekly stats
-    weekly_workouts = 0
-    weekly_calories = 0
+    workout_index = user_data["workout_index"]
+    today = datetime.date.today().toordinal()
     
-    for workout in user_data.get("workout_history", []):
-        workout_date = datetime.datetime.fromisoformat(workout["timestamp"]).date()
-        days_ago = (datetime.datetime.now().date() - workout_date).days
-        
-        if days_ago <= 7:
-            weekly_workouts += 1
-            # Estimate calories burned (MET value * duration in hours * weight in kg)
-            if workout["type"] == "squat":
-                calories = 5 * (workout["duration"] / 60) * 70  # Assuming 70kg weight
-                weekly_calories += calories
+    # Calculate weekly stats (calories estimated per workout; see workout_calories)
+    weekly_workouts, _, weekly_calories = workout_index.totals_since(today - 7)
     
     # Calculate consistency
-    if len(user_data["workout_history"]) > 0:
-        dates = set(datetime.datetime.fromisoformat(w["timestamp"]).date() 
-                   for w in user_data["workout_history"])
-        consistency = min(100, len(dates) * 100 / 30)  # Percentage of days with workouts
-    else:
-        consistency = 0
+    consistency = min(100, len(workout_index) * 100 / 30)  # Percentage of days with workouts
     
     # Get latest performance trend
-    performance_scores = user_data.get("performance_scores", [])
+    performance_scores = user_data["performance_scores"].view(2)
     if len(performance_scores) >= 2:
         trend = "↑ Improving" if performance_scores[-1] > performance_scores[-2] else "↓ Declining"
     else:
@@ -995,37 +3550,13 @@ def dashboard_data():
         "weekly_calories": round(weekly_calories),
         "consistency_score": round(consistency),
         "performance_trend": trend,
-        "current_streak": calculate_streak(user_data["workout_history"]),
+        "current_streak": calculate_streak(workout_index),
         "next_recommended_workout": "Lower Body Strength"
     })
 
-def calculate_streak(workout_history):
-    if not workout_history:
-        return 0
-    
-    # Sort by date
-    dates = sorted(set(datetime.datetime.fromisoformat(w["timestamp"]).date() 
-                      for w in workout_history), reverse=True)
-    
-    streak = 0
-    current_date = datetime.datetime.now().date()
-    
-    for i, workout_date in enumerate(dates):
-        if i == 0:
-            # Check if latest workout was today or yesterday
-            if (current_date - workout_date).days <= 1:
-                streak += 1
-            else:
-                break
-        else:
-            # Check if consecutive days
-            prev_date = dates[i-1]
-            if (prev_date - workout_date).days == 1:
-                streak += 1
-            else:
-                break
-    
-    return streak
+def calculate_streak(workout_index):
+    # Latest workout today or yesterday, then consecutive days back from it
+    return workout_index.streak(datetime.date.today().toordinal())
 
 if __name__ == "__main__":
     print("\n🚀 AI Fitness Platform running at: http://127.0.0.1:5000")
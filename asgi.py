@@ -0,0 +1,272 @@
+# asgi.py - ASYNC SERVING MODE
+"""Serve the Flask app over ASGI so slow pose inference can't starve cheap routes.
+
+Requests are split into three classes, each with its own threads, and
+the event loop itself never runs a WSGI call:
+
+* vision (/api/predict, /ws/predict): run on a bounded thread pool of
+  ASGI_VISION_WORKERS threads. Once ASGI_VISION_MAX_PENDING requests are
+  waiting or running, new ones are answered 503 "busy" straight away
+  instead of queueing behind the backlog.
+* heavy (/api/diet_recommendation/batch, /api/habit_scores): whole-cohort
+  numpy work, bounded the same way by ASGI_HEAVY_WORKERS and
+  ASGI_HEAVY_MAX_PENDING.
+* everything else (chat, dashboard, landmarks, static files): a pool of
+  ASGI_LIGHT_WORKERS threads that the other two classes can't occupy.
+
+The Flask routes are called unchanged through a small ASGI -> WSGI
+gateway. The WebSocket streams are served natively with the same
+latest-frame-wins behaviour as the flask-sock endpoints.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    python asgi.py --port 5000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app
+
+ASGI_VISION_WORKERS = int(os.environ.get("ASGI_VISION_WORKERS", os.cpu_count() or 1))
+ASGI_VISION_MAX_PENDING = int(os.environ.get("ASGI_VISION_MAX_PENDING", ASGI_VISION_WORKERS * 2))
+ASGI_HEAVY_WORKERS = int(os.environ.get("ASGI_HEAVY_WORKERS", 1))
+ASGI_HEAVY_MAX_PENDING = int(os.environ.get("ASGI_HEAVY_MAX_PENDING", ASGI_HEAVY_WORKERS * 2))
+ASGI_LIGHT_WORKERS = int(os.environ.get("ASGI_LIGHT_WORKERS", min(4, os.cpu_count() or 1)))
+ASGI_MAX_BODY = int(os.environ.get("ASGI_MAX_BODY", 16 * 1024 * 1024))
+VISION_PATHS = ("/api/predict", "/ws/predict")
+HEAVY_PATHS = ("/api/diet_recommendation/batch", "/api/habit_scores")
+
+BUSY = json.dumps({"ok": False, "reason": "busy", "message": "Server busy, frame skipped"}).encode()
+FRAME_ERROR = {"ok": False, "reason": "frame_error", "message": "Frame could not be processed"}
+
+
+class BoundedPool:
+    """Thread pool that turns work away once `max_pending` calls are waiting or running"""
+
+    def __init__(self, workers, max_pending, name):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        """fn(*args) on the pool; None if the backlog is already full"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return None
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+
+class WSGIGateway:
+    """ASGI application that runs a WSGI app, routing work by cost"""
+
+    def __init__(self, wsgi_app, vision_workers=ASGI_VISION_WORKERS, vision_max_pending=ASGI_VISION_MAX_PENDING,
+                 heavy_workers=ASGI_HEAVY_WORKERS, heavy_max_pending=ASGI_HEAVY_MAX_PENDING,
+                 light_workers=ASGI_LIGHT_WORKERS):
+        self.wsgi_app = wsgi_app
+        self.vision = BoundedPool(vision_workers, vision_max_pending, "asgi-vision")
+        self.heavy = BoundedPool(heavy_workers, heavy_max_pending, "asgi-heavy")
+        self.light_pool = ThreadPoolExecutor(max(1, light_workers), thread_name_prefix="asgi-light")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.websocket(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+
+    # ----- work classes -----
+    async def run_light(self, fn, *args):
+        # WSGI handlers block on client locks and SQLite; keep them off the event loop
+        return await asyncio.get_running_loop().run_in_executor(self.light_pool, fn, *args)
+
+    # ----- HTTP -----
+    async def http(self, scope, receive, send):
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > ASGI_MAX_BODY:
+                await self.respond(send, 413, [(b"content-type", b"text/plain")], b"Request body too large")
+                return
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                break
+        environ = self.environ(scope, b"".join(chunks))
+
+        pool = self.vision if scope["path"] in VISION_PATHS else self.heavy if scope["path"] in HEAVY_PATHS else None
+        if pool:
+            result = await pool.run(self.call_wsgi, environ)
+            if result is None:
+                await self.respond(send, 503, [(b"content-type", b"application/json")], BUSY)
+                return
+        else:
+            result = await self.run_light(self.call_wsgi, environ)
+        await self.respond(send, *result)
+
+    @staticmethod
+    async def respond(send, status, headers, body):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    def environ(scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_LENGTH":
+                continue
+            key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def call_wsgi(self, environ):
+        """(status, headers, body) of one WSGI call"""
+        response = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+            return written.append
+
+        body = self.wsgi_app(environ, start_response)
+        try:
+            written.extend(body)
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        return response["status"], response["headers"], b"".join(written)
+
+    # ----- WebSocket -----
+    async def websocket(self, scope, receive, send):
+        query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        cid = query.get("client_id", "default")
+        exercise = query.get("exercise", "squat")
+
+        if scope["path"] == "/ws/predict":
+            handle, run = (lambda frame: app.predict_frame(frame, cid, exercise)), self.vision.run
+        elif scope["path"] == "/ws/landmarks":
+            size = app.parse_frame_size(query.get("width", app.DEFAULT_FRAME_SIZE[0]),
+                                        query.get("height", app.DEFAULT_FRAME_SIZE[1]))
+            if size is None:
+                await receive()
+                await send({"type": "websocket.close", "code": 1008})  # bad width/height
+                return
+            w, h = size
+            handle, run = (lambda frame: app.landmarks_frame(frame, cid, exercise, w, h)), self.run_light
+        else:
+            await receive()
+            await send({"type": "websocket.close", "code": 1008})
+            return
+
+        if (await receive())["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+
+        # Latest frame wins: a reader task keeps only the newest frame and
+        # counts the ones it replaced while a frame was being processed
+        pending = {"frame": None, "dropped": 0, "closed": False}
+        ready = asyncio.Event()
+
+        async def reader():
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    pending["closed"] = True
+                    ready.set()
+                    return
+                if not message.get("bytes"):
+                    continue  # text or empty frames carry no image/landmarks
+                if pending["frame"] is not None:
+                    pending["dropped"] += 1
+                pending["frame"] = message["bytes"]
+                ready.set()
+
+        reader_task = asyncio.create_task(reader())
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                if pending["closed"]:
+                    break
+                frame, dropped = pending["frame"], pending["dropped"]
+                pending["frame"], pending["dropped"] = None, 0
+                try:
+                    result = await run(handle, frame)
+                except Exception as e:
+                    # One bad frame answers with an error instead of closing the stream
+                    print(f"⚠ Frame failed on {scope['path']}: {e!r}")
+                    result = dict(FRAME_ERROR)
+                if result is None:
+                    result = json.loads(BUSY)
+                result["dropped"] = dropped
+                await send({"type": "websocket.send", "text": json.dumps(result)})
+        finally:
+            reader_task.cancel()
+
+    # ----- lifespan -----
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for executor in (self.vision.executor, self.heavy.executor, self.light_pool):
+                    executor.shutdown(wait=False)
+                app.get_state_store().flush()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = WSGIGateway(app.app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fitness platform in async serving mode")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("⚠ Install uvicorn for async serving: pip install uvicorn")
+    print(f"\n🚀 AI Fitness Platform (async) running at: http://{args.host}:{args.port}")
+    uvicorn.run(application, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
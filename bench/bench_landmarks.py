@@ -0,0 +1,138 @@
+"""Micro-benchmark: per-frame landmark post-processing, before vs after.
+
+"before" is the dict-based path squat_counter used originally (33-entry
+point and visibility dicts, one angle() call per knee, scalar back
+angle); it is the real baseline. "before_all" is the same path asked for
+every joint, for reference. "after" is what _count_reps does now:
+landmarks_to_array, then joint_angles, joint_visibility and
+back_angle_of on the (33, 4) array, covering knees, hips, elbows and
+shoulders.
+
+Frames are MediaPipe NormalizedLandmarkList protobufs when mediapipe is
+installed (attribute reads on those cost more than on plain objects, and
+both paths pay them), else plain objects with the same attributes.
+
+    python bench/bench_landmarks.py [--frames 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+import numpy as np
+
+os.environ.setdefault("STATE_STORE", "memory")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app  # noqa: E402
+
+W, H = 640, 480
+
+
+try:
+    from mediapipe.framework.formats import landmark_pb2
+except ImportError:
+    landmark_pb2 = None
+
+
+def make_pose_landmarks(rng):
+    """MediaPipe's pose_landmarks, or an object shaped like it"""
+    values = rng.uniform(0.05, 0.95, size=(33, 4)).astype(np.float32).tolist()
+    if landmark_pb2 is not None:
+        landmarks = landmark_pb2.NormalizedLandmarkList()
+        for x, y, z, v in values:
+            landmarks.landmark.add(x=x, y=y, z=z, visibility=v)
+        return landmarks
+    return SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z, visibility=v) for x, y, z, v in values])
+
+
+# ----- before -----
+def legacy_angle(a, b, c):
+    a, b, c = np.array(a), np.array(b), np.array(c)
+    ba = a - b
+    bc = c - b
+    cosv = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc) + 1e-9)
+    cosv = np.clip(cosv, -1, 1)
+    return float(np.degrees(np.arccos(cosv)))
+
+
+def legacy_frame(pose_landmarks):
+    pts = {}
+    for i, lm in enumerate(pose_landmarks.landmark):
+        pts[i] = (lm.x * W, lm.y * H)
+    vis = {}
+    for i, lm in enumerate(pose_landmarks.landmark):
+        vis[i] = lm.visibility
+
+    left = all(idx in pts and vis.get(idx, 0) > 0.3 for idx in [23, 25, 27])
+    right = all(idx in pts and vis.get(idx, 0) > 0.3 for idx in [24, 26, 28])
+    left_knee = legacy_angle(pts[23], pts[25], pts[27])
+    right_knee = legacy_angle(pts[24], pts[26], pts[28])
+
+    shoulder_mid = ((pts[11][0] + pts[12][0]) / 2, (pts[11][1] + pts[12][1]) / 2)
+    hip_mid = ((pts[23][0] + pts[24][0]) / 2, (pts[23][1] + pts[24][1]) / 2)
+    back = abs(np.degrees(np.arctan2(shoulder_mid[0] - hip_mid[0], shoulder_mid[1] - hip_mid[1])))
+    return left, right, left_knee, right_knee, back
+
+
+def legacy_frame_all_joints(pose_landmarks):
+    """The dict-based path extended to every joint the batched path covers"""
+    pts = {}
+    for i, lm in enumerate(pose_landmarks.landmark):
+        pts[i] = (lm.x * W, lm.y * H)
+    angles = [legacy_angle(pts[a], pts[b], pts[c]) for a, b, c in app.JOINT_TRIPLETS.values()]
+    return legacy_frame(pose_landmarks), angles
+
+
+# ----- after -----
+def vectorized_frame(pose_landmarks):
+    landmarks = app.landmarks_to_array(pose_landmarks)
+    angles = app.joint_angles(landmarks, W, H)
+    visible = app.joint_visibility(landmarks)
+    back = app.back_angle_of(landmarks, W, H)
+    left, right = app.JOINTS["left_knee"], app.JOINTS["right_knee"]
+    return bool(visible[left]), bool(visible[right]), angles[left], angles[right], back
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [make_pose_landmarks(rng) for _ in range(256)]
+
+    # Both paths must agree before their timings mean anything
+    for f in frames:
+        before, after = legacy_frame(f), vectorized_frame(f)
+        assert before[:2] == after[:2]
+        assert np.allclose(before[2:], after[2:], atol=1e-3), (before, after)
+
+    paths = (("before", legacy_frame),
+             ("before_all", legacy_frame_all_joints),
+             ("after", vectorized_frame))
+    # Rounds alternate between the paths so a noisy stretch doesn't land on just one
+    number = max(1, args.frames // 5)
+    results = {name: float("inf") for name, _ in paths}
+    for _ in range(5):
+        for name, fn in paths:
+            it = iter(frames * (number // len(frames) + 1))
+            seconds = timeit.timeit(lambda: fn(next(it)), number=number)
+            results[name] = min(results[name], seconds / number * 1e6)
+
+    n_joints = len(app.JOINT_TRIPLETS)
+    labels = {
+        "before": "dict path, 2 knees",
+        "before_all": f"dict path, {n_joints} joints",
+        "after": f"array path, {n_joints} joints"
+    }
+    print(f"landmarks: {'MediaPipe protobuf' if landmark_pb2 is not None else 'plain objects'}")
+    print(f"{'path':<26} {'us/frame':>10}")
+    for name, us in results.items():
+        print(f"{labels[name]:<26} {us:>10.1f}")
+    print(f"before -> after (2 knees -> {n_joints} joints): {results['before'] / results['after']:.2f}x")
+    print(f"same joint set ({n_joints} joints): {results['before_all'] / results['after']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
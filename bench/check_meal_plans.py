@@ -0,0 +1,69 @@
+"""Check that solved meal plans hit their calorie targets for every diet type.
+
+Sweeps profiles (weight, goal, activity level) for each diet in the food
+table and compares the planner's total calories with the profile's
+daily target. Targets above --max-calories are skipped: past that the
+foods' portion caps, not the solver, set the total.
+
+    python bench/check_meal_plans.py
+    python bench/check_meal_plans.py --tolerance 0.05
+"""
+import argparse
+import os
+import sys
+
+os.environ.setdefault("STATE_STORE", "memory")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app  # noqa: E402
+
+DIETS = ("balanced", "vegetarian", "vegan", "keto")
+
+
+def profiles(diet):
+    for goal in app.GOAL_ADJUSTMENTS:
+        for activity_level in app.ACTIVITY_MULTIPLIERS:
+            for weight in range(45, 150, 5):
+                yield {"weight": weight, "height": 175, "age": 30, "gender": "male", "goal": goal,
+                       "activity_level": activity_level, "dietary_preference": diet}
+
+
+def worst_error(diet, min_calories, max_calories):
+    """(plans checked, worst relative calorie error, its target, its goal)"""
+    checked, worst = 0, (0.0, None, None)
+    for profile in profiles(diet):
+        result = app.get_diet_recommendation(profile)
+        target = result["daily_calories"]
+        if not min_calories <= target <= max_calories:
+            continue
+        checked += 1
+        error = result["plan_totals"]["calories"] / target - 1
+        if abs(error) > abs(worst[0]):
+            worst = (error, target, profile["goal"])
+    return (checked,) + worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check meal plan calories against their targets")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="largest allowed relative calorie error")
+    parser.add_argument("--min-calories", type=float, default=1200)
+    parser.add_argument("--max-calories", type=float, default=3500)
+    args = parser.parse_args()
+
+    if app.get_meal_planner() is None:
+        print(f"No food table at {app.FOOD_TABLE_PATH}")
+        sys.exit(1)
+
+    ok = True
+    for diet in DIETS:
+        checked, error, target, goal = worst_error(diet, args.min_calories, args.max_calories)
+        passed = checked > 0 and abs(error) <= args.tolerance
+        ok = ok and passed
+        print(f"{diet:<11} plans={checked} worst={error:+.1%} (target {target} kcal, goal {goal}) "
+              f"{'ok' if passed else 'FAILED'}")
+
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
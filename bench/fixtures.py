@@ -0,0 +1,186 @@
+"""Benchmark fixtures: short JPEG sequences with matching landmark arrays.
+
+A fixture is a directory under bench/fixtures/ holding frame_000.jpg,
+frame_001.jpg, ... plus landmarks.npy, an (n_frames, 33, 4) float32
+array in MediaPipe's normalized layout (NaN rows where no pose was found).
+
+Recorded fixtures are checked in (see bench/fixtures/RECORDED.md): real
+footage, downscaled, with the landmarks MediaPipe found in each frame.
+They are what the pose and /api/predict timings run on. Record more with
+
+    python bench/fixtures.py --video session.mp4 --name recorded-gym-squat --frames 60 --every 3 --width 640
+
+Synthetic fixtures (a rendered stick figure squatting or doing push-ups)
+are generated on first use. MediaPipe finds no pose in the stick figure
+and their landmarks are the ground truth it was drawn from, so they are
+landmark-only: the suite uses them for the landmark stages and
+/api/landmarks, never for pose or /api/predict timings.
+"""
+import argparse
+import glob
+import math
+import os
+import sys
+
+import cv2
+import numpy as np
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SYNTHETIC = {
+    # name: (exercise, width, height, frames)
+    "synthetic-squat-vga": ("squat", 640, 480, 40),
+    "synthetic-squat-hd": ("squat", 1280, 720, 40),
+    "synthetic-pushup-vga": ("pushup", 640, 480, 40)
+}
+BONES = [(11, 12), (11, 13), (13, 15), (12, 14), (14, 16), (11, 23), (12, 24), (23, 24),
+         (23, 25), (25, 27), (24, 26), (26, 28), (27, 31), (28, 32)]
+
+
+def _limb(start, length, degrees):
+    rad = math.radians(degrees)
+    return start + length * np.array([math.sin(rad), -math.cos(rad)])
+
+
+def synthetic_landmarks(exercise, phase, aspect):
+    """One frame of a side-on body at `phase` (0 = top of the rep, 1 = bottom)"""
+    lm = np.zeros((33, 4), dtype=np.float32)
+    lm[:, 3] = 0.95
+    xs = 1 / aspect  # keeps limb lengths equal in pixels on both axes
+    depth = (1 - math.cos(phase * math.pi)) / 2
+
+    if exercise == "squat":
+        knee_angle = 170 - 85 * depth
+        for offset, (hip, knee, ankle, shoulder, elbow, wrist, foot) in (
+                (-0.02, (23, 25, 27, 11, 13, 15, 31)), (0.02, (24, 26, 28, 12, 14, 16, 32))):
+            a = np.array([0.5 + offset, 0.88])
+            k = a + (_limb(np.zeros(2), 0.2, 20 * depth) * [xs, 1])
+            h = k + (_limb(np.zeros(2), 0.2, -(180 - knee_angle) + 20 * depth) * [xs, 1])
+            s = h + (_limb(np.zeros(2), 0.28, 30 * depth) * [xs, 1])
+            e = s + (_limb(np.zeros(2), 0.14, 90 + 60 * depth) * [xs, 1])
+            for idx, point in ((ankle, a), (knee, k), (hip, h), (shoulder, s), (elbow, e),
+                               (wrist, e + [0.12 * xs, 0]), (foot, a + [0.06 * xs, 0.02])):
+                lm[idx, :2] = point
+    else:
+        elbow_angle = 170 - 90 * depth
+        for offset, (hip, knee, ankle, shoulder, elbow, wrist, foot) in (
+                (-0.01, (23, 25, 27, 11, 13, 15, 31)), (0.01, (24, 26, 28, 12, 14, 16, 32))):
+            w = np.array([0.3, 0.85 + offset])
+            e = w + (_limb(np.zeros(2), 0.13, 10 - (180 - elbow_angle) / 2) * [xs, 1])
+            s = e + (_limb(np.zeros(2), 0.13, 10 + (180 - elbow_angle) / 2) * [xs, 1])
+            h = s + np.array([0.35 * xs, 0.08])
+            k = h + np.array([0.2 * xs, 0.04])
+            a = k + np.array([0.2 * xs, 0.04])
+            for idx, point in ((wrist, w), (elbow, e), (shoulder, s), (hip, h), (knee, k),
+                               (ankle, a), (foot, a + [0.03 * xs, 0.02])):
+                lm[idx, :2] = point
+
+    head = (lm[11, :2] + lm[12, :2]) / 2 + [0, -0.08]
+    lm[0:11, :2] = head
+    return lm
+
+
+def render(landmarks, width, height, rng):
+    """Stick figure on a gradient background with a little sensor noise"""
+    ramp = np.linspace(40, 90, height, dtype=np.float32)[:, None, None]
+    noise = rng.normal(0, 3, size=(height, width, 1)).astype(np.float32)
+    img = np.clip(np.broadcast_to(ramp, (height, width, 3)) + noise, 0, 255).astype(np.uint8)
+    pts = (landmarks[:, :2] * [width, height]).astype(int)
+    thickness = max(2, width // 80)
+    for a, b in BONES:
+        cv2.line(img, tuple(map(int, pts[a])), tuple(map(int, pts[b])), (200, 180, 160), thickness)
+    cv2.circle(img, tuple(map(int, pts[0])), thickness * 4, (190, 170, 150), -1)
+    return img
+
+
+def write_fixture(name, frames, landmarks):
+    path = os.path.join(FIXTURE_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    for i, img in enumerate(frames):
+        cv2.imwrite(os.path.join(path, f"frame_{i:03d}.jpg"), img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    np.save(os.path.join(path, "landmarks.npy"), np.asarray(landmarks, dtype=np.float32))
+    return path
+
+
+def make_synthetic(name):
+    exercise, width, height, n_frames = SYNTHETIC[name]
+    rng = np.random.default_rng(0)
+    landmarks, frames = [], []
+    for i in range(n_frames):
+        # Two reps per sequence
+        phase = (i % (n_frames // 2)) / (n_frames // 2) * 2
+        lm = synthetic_landmarks(exercise, phase if phase <= 1 else 2 - phase, width / height)
+        landmarks.append(lm)
+        frames.append(render(lm, width, height, rng))
+    return write_fixture(name, frames, landmarks)
+
+
+def ensure_fixtures():
+    for name in SYNTHETIC:
+        if not os.path.exists(os.path.join(FIXTURE_DIR, name, "landmarks.npy")):
+            make_synthetic(name)
+
+
+def load_fixture(name):
+    """(list of JPEG bytes, (n, 33, 4) landmarks, (width, height))"""
+    path = os.path.join(FIXTURE_DIR, name)
+    jpegs = []
+    for frame in sorted(glob.glob(os.path.join(path, "frame_*.jpg"))):
+        with open(frame, "rb") as f:
+            jpegs.append(f.read())
+    landmarks = np.load(os.path.join(path, "landmarks.npy"))
+    h, w = cv2.imdecode(np.frombuffer(jpegs[0], dtype=np.uint8), cv2.IMREAD_COLOR).shape[:2]
+    return jpegs, landmarks, (w, h)
+
+
+def list_fixtures():
+    ensure_fixtures()
+    return sorted(d for d in os.listdir(FIXTURE_DIR) if os.path.exists(os.path.join(FIXTURE_DIR, d, "landmarks.npy")))
+
+
+def record_from_video(video, name, n_frames, every, width=None):
+    """Take every `every`-th frame of a video (scaled to `width`) and store it with its pose landmarks"""
+    os.environ.setdefault("STATE_STORE", "memory")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import app
+
+    pose = app.mp.solutions.pose.Pose()
+    capture = cv2.VideoCapture(video)
+    frames, landmarks = [], []
+    index = 0
+    while len(frames) < n_frames:
+        ok, img = capture.read()
+        if not ok:
+            break
+        if index % every == 0:
+            if width:
+                height = round(img.shape[0] * width / img.shape[1])
+                img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+            lm = app.run_pose(pose, img)
+            frames.append(img)
+            landmarks.append(lm if lm is not None else np.full((33, 4), np.nan, dtype=np.float32))
+        index += 1
+    capture.release()
+    if not frames:
+        raise SystemExit(f"No frames read from {video}")
+    return write_fixture(name, frames, landmarks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create benchmark fixtures")
+    parser.add_argument("--video", help="record a fixture from this video file")
+    parser.add_argument("--name", help="fixture name (directory under bench/fixtures)")
+    parser.add_argument("--frames", type=int, default=40)
+    parser.add_argument("--every", type=int, default=1, help="keep every Nth frame")
+    parser.add_argument("--width", type=int, help="scale frames to this width (keeps aspect ratio)")
+    args = parser.parse_args()
+
+    if args.video:
+        name = args.name or os.path.splitext(os.path.basename(args.video))[0]
+        print(record_from_video(args.video, name, args.frames, args.every, args.width))
+    else:
+        for name in SYNTHETIC:
+            print(make_synthetic(name))
+
+
+if __name__ == "__main__":
+    main()
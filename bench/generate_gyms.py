@@ -0,0 +1,82 @@
+"""Generate a large synthetic gym catalog for the gym recommender.
+
+Gyms are scattered around the cities in data/cities.csv (denser near the
+centre) with random ratings, price levels, features and specialties drawn
+from the same vocabulary as the real rows, which are copied in first.
+Point the app at the result with GYM_CATALOG_PATH:
+
+    python bench/generate_gyms.py --gyms 50000
+    GYM_CATALOG_PATH=bench/fixtures/synthetic-gyms/gyms.csv python app.py
+"""
+import argparse
+import csv
+import math
+import os
+import random
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "synthetic-gyms", "gyms.csv")
+
+CHAINS = ["Fitness First", "Anytime Fitness", "CrossFit", "Planet Fitness", "Equinox", "Gold's Gym",
+          "24 Hour Fitness", "LA Fitness", "Snap Fitness", "Iron Temple", "Yoga Loft", "Pulse Studio"]
+STREETS = ["Main St", "Oak Ave", "Park Rd", "Market St", "Elm St", "River Rd", "Lake Blvd", "Hill Ln"]
+FEATURES = ["24/7 access", "Pool", "Sauna", "Group classes", "Personal trainers", "Basic equipment",
+            "Virtual classes", "CrossFit classes", "Open gym", "Community events", "Judgement free zone",
+            "Massage chairs", "Tanning", "Luxury amenities", "Spa", "Restaurant", "Basketball court",
+            "Parking", "Showers", "Childcare"]
+SPECIALTIES = ["Strength training", "Cardio", "Yoga", "Convenience", "Basic fitness", "CrossFit",
+               "High-intensity training", "High-intensity", "Beginner friendly", "Beginner",
+               "Luxury fitness", "Holistic wellness", "Pilates", "Boxing"]
+FEES = {1: (10, 30), 2: (30, 70), 3: (70, 130), 4: (130, 200), 5: (200, 350)}
+
+
+def load_csv(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def synthetic_gym(rng, city, number):
+    # Gaussian scatter, ~8 km spread, so city centres are dense and suburbs sparse
+    km_north, km_east = rng.gauss(0, 8), rng.gauss(0, 8)
+    lat = float(city["lat"]) + km_north / 111.195
+    lon = float(city["lon"]) + km_east / (111.195 * math.cos(math.radians(float(city["lat"]))))
+    level = rng.choices(range(1, 6), weights=[3, 4, 3, 2, 1])[0]
+    chain = rng.choice(CHAINS)
+    return {
+        "name": f"{chain} {city['name']} #{number}",
+        "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, {city['name']}",
+        "lat": f"{lat:.6f}",
+        "lon": f"{lon:.6f}",
+        "rating": f"{min(5.0, max(1.0, rng.gauss(4.2, 0.4))):.1f}",
+        "price_range": "$" * level,
+        "features": "|".join(rng.sample(FEATURES, rng.randint(2, 6))),
+        "specialties": "|".join(rng.sample(SPECIALTIES, rng.randint(1, 3))),
+        "membership_fee": f"${rng.randint(*FEES[level])}/month"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic gym catalog")
+    parser.add_argument("--gyms", type=int, default=50000, help="synthetic gyms to add to the real rows")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    real = load_csv(os.path.join(ROOT, "data", "gyms.csv"))
+    cities = load_csv(os.path.join(ROOT, "data", "cities.csv"))
+    # Bigger share of gyms for the first (largest) cities
+    weights = [1 / (i + 1) ** 0.5 for i in range(len(cities))]
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(real[0]))
+        writer.writeheader()
+        writer.writerows(real)
+        for number in range(1, args.gyms + 1):
+            writer.writerow(synthetic_gym(rng, rng.choices(cities, weights=weights)[0], number))
+    print(f"Wrote {len(real) + args.gyms} gyms to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
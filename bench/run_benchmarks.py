@@ -0,0 +1,262 @@
+"""Benchmark suite for the vision hot path.
+
+Replays the fixtures in bench/fixtures through each stage of /api/predict
+and through the Flask test client end to end. Runs offline on CPU.
+
+Pose and /api/predict rows run on the recorded fixtures only, and the
+suite exits with an error if MediaPipe finds no pose in any frame of one,
+or if no /api/predict request gets through rep counting: timings of the
+"no person detected" exit are not pose timings. Synthetic fixtures are
+landmark-only (see bench/fixtures.py).
+
+    python bench/run_benchmarks.py                      # print a report
+    python bench/run_benchmarks.py -o before.json       # also save results
+    python bench/run_benchmarks.py -o after.json --compare before.json
+    python bench/run_benchmarks.py --quick              # fewer iterations
+
+Stage timings are per call in microseconds (mean, p50, p95, p99).
+End-to-end results are frames/sec and p50/p95/p99 latency in ms for
+sequential requests. The motion gate is disabled for the "predict"
+rows so every frame pays for full inference; "predict_gated" shows the
+configured gate.
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+os.environ.setdefault("STATE_STORE", "memory")
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+import app  # noqa: E402
+from fixtures import SYNTHETIC, list_fixtures, load_fixture  # noqa: E402
+
+
+def summarize(samples, scale):
+    samples = np.asarray(samples) * scale
+    return {
+        "n": len(samples),
+        "mean": round(float(samples.mean()), 2),
+        "p50": round(float(np.percentile(samples, 50)), 2),
+        "p95": round(float(np.percentile(samples, 95)), 2),
+        "p99": round(float(np.percentile(samples, 99)), 2)
+    }
+
+
+def time_calls(fn, inputs, iterations, warmup=3):
+    """Per-call latencies of fn(x), cycling through inputs"""
+    for x in inputs[:warmup]:
+        fn(x)
+    samples = []
+    clock = time.perf_counter
+    for i in range(iterations):
+        x = inputs[i % len(inputs)]
+        start = clock()
+        fn(x)
+        samples.append(clock() - start)
+    return samples
+
+
+def check_detections(name):
+    """Frames of a recorded fixture MediaPipe finds a pose in; exits if none"""
+    jpegs, _, _ = load_fixture(name)
+    with app.mp.solutions.pose.Pose() as pose:
+        detected = sum(app.run_pose(pose, app.decode_image_bytes(j)) is not None for j in jpegs)
+    if not detected:
+        raise SystemExit(f"{name}: MediaPipe found no pose in any of its {len(jpegs)} frames; "
+                         "its pose timings would only measure the no-pose exit")
+    return detected, len(jpegs)
+
+
+def stage_benchmarks(name, iterations, pose_iterations):
+    jpegs, landmarks, (w, h) = load_fixture(name)
+    data_urls = ["data:image/jpeg;base64," + base64.b64encode(j).decode() for j in jpegs]
+    images = [app.decode_image_bytes(j) for j in jpegs]
+    rgbs = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in images]
+    tracked = [i for i, lm in enumerate(landmarks) if np.isfinite(lm).all()]
+    found = [landmarks[i] for i in tracked]
+    proto = _as_pose_landmarks(found)
+
+    pose = app.mp.solutions.pose.Pose()
+    roi_images = [(images[i], app.roi_from_landmarks(landmarks[i], w, h)) for i in tracked]
+
+    state = app.new_rep_state()
+    angles = [app.joint_angles(lm, w, h) for lm in found]
+    visible = [app.joint_visibility(lm) for lm in found]
+    scores = list(np.random.default_rng(0).integers(40, 95, size=50))
+
+    stages = {
+        "decode_b64_image": (app.decode_b64_image, data_urls, iterations),
+        "decode_image_bytes": (app.decode_image_bytes, jpegs, iterations),
+        "cvtColor": (lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2RGB), images, iterations),
+        "motion_thumbnail": (app.motion_thumbnail, images, iterations),
+        "pose.process": (pose.process, rgbs, pose_iterations),
+        "run_pose_roi": (lambda x: app.run_pose(pose, x[0], x[1]), roi_images, pose_iterations),
+        "landmarks_to_array": (app.landmarks_to_array, proto, iterations),
+        "joint_angles": (lambda lm: app.joint_angles(lm, w, h), found, iterations),
+        "evaluate_exercises": (lambda i: app.evaluate_exercises(angles[i], visible[i], state),
+                               list(range(len(found))), iterations),
+        "count_reps": (lambda lm: app.count_reps(lm, w, h, f"bench-{name}"), found, iterations),
+        "calculate_performance_score": (lambda s: app.calculate_performance_score(s, 10, 0.9, 0.8),
+                                        [95.0, 120.0, 140.0], iterations),
+        "generate_feedback": (lambda s: app.generate_feedback(s, 10, 0.9, 0.8), [75.0, 95.0, 130.0], iterations),
+        "calculate_weekly_trend": (lambda n: app.calculate_weekly_trend(scores[:n]), [2, 10, 50], iterations)
+    }
+
+    if name in SYNTHETIC:
+        # No pose to find in a stick figure
+        del stages["pose.process"], stages["run_pose_roi"]
+
+    results = {}
+    for stage, (fn, inputs, n) in stages.items():
+        if not inputs:
+            continue
+        results[stage] = summarize(time_calls(fn, inputs, n), 1e6)
+    pose.close()
+    return results
+
+
+def _as_pose_landmarks(arrays):
+    """Objects shaped like MediaPipe's pose_landmarks, for landmarks_to_array"""
+    from types import SimpleNamespace
+    return [SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z, visibility=v) for x, y, z, v in lm.tolist()])
+            for lm in arrays]
+
+
+def end_to_end(name, iterations):
+    jpegs, landmarks, (w, h) = load_fixture(name)
+    client = app.app.test_client()
+    found = [lm for lm in landmarks if np.isfinite(lm).all()]
+    packed = [lm.astype("<f4").tobytes() for lm in found]
+    bodies = [json.dumps({"image": "data:image/jpeg;base64," + base64.b64encode(j).decode(),
+                          "client_id": f"e2e-json-{name}"}) for j in jpegs]
+
+    def post_json(body):
+        return client.post("/api/predict", data=body, content_type="application/json")
+
+    def post_binary(jpeg):
+        return client.post("/api/predict", data=jpeg, headers={
+            "Content-Type": "application/octet-stream", "X-Client-Id": f"e2e-bin-{name}"})
+
+    def post_landmarks(buf):
+        return client.post(f"/api/landmarks?width={w}&height={h}", data=buf, headers={
+            "Content-Type": "application/octet-stream", "X-Client-Id": f"e2e-lm-{name}"})
+
+    runs = {}
+    if name not in SYNTHETIC:
+        threshold = app.MOTION_THRESHOLD
+        app.MOTION_THRESHOLD = -1  # every frame goes through inference
+        try:
+            outcomes = Counter(post_binary(j).get_json().get("reason") or "counted" for j in jpegs)
+            if not outcomes["counted"]:
+                raise SystemExit(f"{name}: no /api/predict request reached rep counting ({dict(outcomes)}); "
+                                 "end-to-end timings would only measure early exits")
+            runs["predict_json"] = time_calls(post_json, bodies, iterations)
+            runs["predict_binary"] = time_calls(post_binary, jpegs, iterations)
+        finally:
+            app.MOTION_THRESHOLD = threshold
+        runs["predict_gated"] = time_calls(post_binary, jpegs, iterations)
+    if packed:
+        runs["landmarks"] = time_calls(post_landmarks, packed, iterations * 10)
+
+    results = {}
+    for run, samples in runs.items():
+        stats = summarize(samples, 1e3)
+        stats["fps"] = round(len(samples) / sum(samples), 1)
+        results[run] = stats
+    return results
+
+
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                             capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git": rev,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "mediapipe": getattr(app.mp, "__version__", None)
+    }
+
+
+def print_report(results, baseline=None):
+    def delta(section, fixture, row, key):
+        try:
+            old = baseline[section][fixture][row][key]
+        except (KeyError, TypeError):
+            return ""
+        new = results[section][fixture][row][key]
+        return f" ({(new - old) / old * 100:+.0f}%)" if old else ""
+
+    for fixture, (detected, frames) in results["detections"].items():
+        print(f"{fixture}: pose found in {detected}/{frames} frames")
+
+    for fixture, stages in results["stages"].items():
+        print(f"\n== stages: {fixture} (us per call)")
+        print(f"{'stage':<28}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for stage, s in stages.items():
+            print(f"{stage:<28}{s['mean']:>10.1f}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}"
+                  f"{delta('stages', fixture, stage, 'p50')}")
+
+    for fixture, runs in results["end_to_end"].items():
+        print(f"\n== end to end: {fixture} (ms per request)")
+        print(f"{'route':<18}{'fps':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for run, s in runs.items():
+            print(f"{run:<18}{s['fps']:>10.1f}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}"
+                  f"{delta('end_to_end', fixture, run, 'p50')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vision hot path")
+    parser.add_argument("-o", "--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to diff p50s against")
+    parser.add_argument("--fixture", action="append", help="only these fixtures (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    args = parser.parse_args()
+
+    if app.mp is None:
+        raise SystemExit("mediapipe is required for the benchmark suite")
+
+    iterations = 200 if args.quick else 2000
+    pose_iterations = 20 if args.quick else 100
+    e2e_iterations = 20 if args.quick else 100
+
+    fixtures = args.fixture or list_fixtures()
+    results = {"environment": environment(), "detections": {}, "stages": {}, "end_to_end": {}}
+    for name in fixtures:
+        if name not in SYNTHETIC:
+            results["detections"][name] = check_detections(name)
+    for name in fixtures:
+        results["stages"][name] = stage_benchmarks(name, iterations, pose_iterations)
+        results["end_to_end"][name] = end_to_end(name, e2e_iterations)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
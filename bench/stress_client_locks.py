@@ -0,0 +1,146 @@
+"""Stress check for per-client locking in the rep counter.
+
+Many threads push landmark frames for the same client at once, with a
+tiny thread switch interval to force interleavings. Every completed rep
+must show up in the client's counter, every frame in its score stats, and
+the running score sums must still match the scores they summarize; a lost
+read-modify-write shows up as a mismatch.
+
+A second phase holds one client's lock and checks that clients on other
+stripes keep being served.
+
+    python bench/stress_client_locks.py
+    python bench/stress_client_locks.py --no-locks   # shows what breaks without them
+
+With --no-locks the check is inverted: it passes only if a lost update
+is found, so a run too small to provoke one fails instead of looking
+like proof that the locks are unnecessary.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+os.environ.setdefault("STATE_STORE", "memory")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app  # noqa: E402
+from fixtures import synthetic_landmarks  # noqa: E402
+
+W, H = 640, 480
+
+
+class NoLock:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+def squat_cycle(steps=12):
+    phases = np.concatenate([np.linspace(0, 1, steps // 2), np.linspace(1, 0, steps // 2)])
+    return [synthetic_landmarks("squat", phase, W / H) for phase in phases]
+
+
+def same_client(threads, cycles):
+    """All threads hammer one client.
+
+    Returns (reps counted, reps completed, frames scored, frames sent,
+    score aggregates consistent).
+    """
+    client_id = "stress-shared"
+    completed = [0]
+    completed_lock = threading.Lock()
+    original_save_rep = app.save_rep
+
+    def counting_save_rep(*args):
+        with completed_lock:
+            completed[0] += 1
+        return original_save_rep(*args)
+
+    app.save_rep = counting_save_rep
+    frames = squat_cycle()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(cycles):
+            for landmarks in frames:
+                app.count_reps(landmarks, W, H, client_id)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    app.save_rep = original_save_rep
+
+    reps = int(app.get_session(client_id).reps["reps"][app.EXERCISE_INDEX["squat"]])
+    stats = app.USER_DATA[client_id]["performance_scores"]
+    # Running sums must still match the buffer they summarize
+    consistent = (stats.window_sum == int(stats.view().sum())
+                  and stats.recent_sum == int(stats.view(stats.RECENT).sum()))
+    return reps, completed[0], stats.seen, threads * cycles * len(frames), consistent
+
+
+def other_clients_proceed(clients, hold_seconds):
+    """Hold one client's lock; time frames for clients on other stripes"""
+    blocked = "stress-blocked"
+    blocked_stripe = app.client_lock.stripe(blocked)
+    others = [f"stress-free-{i}" for i in range(clients * 2)]
+    others = [c for c in others if app.client_lock.stripe(c) != blocked_stripe][:clients]
+    landmarks = squat_cycle()[0]
+
+    held = threading.Event()
+
+    def holder():
+        with app.client_lock(blocked):
+            held.set()
+            time.sleep(hold_seconds)
+
+    t = threading.Thread(target=holder)
+    t.start()
+    held.wait()
+    start = time.perf_counter()
+    for client_id in others:
+        app.count_reps(landmarks, W, H, client_id)
+    elapsed = time.perf_counter() - start
+    t.join()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress per-client locking")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--cycles", type=int, default=40, help="squat reps per thread")
+    parser.add_argument("--no-locks", action="store_true", help="disable client locks to show lost updates")
+    args = parser.parse_args()
+
+    if args.no_locks:
+        app.client_lock = type("NoLocks", (), {"__call__": lambda self, cid: NoLock(),
+                                               "stripe": lambda self, cid: 0})()
+    sys.setswitchinterval(1e-6)
+
+    reps, completed, scored, sent, consistent = same_client(args.threads, args.cycles)
+    print(f"same client, {args.threads} threads: counter={reps} completed={completed} "
+          f"scored={scored} frames={sent} aggregates_consistent={consistent}")
+    ok = reps == completed and scored == sent and consistent
+
+    if args.no_locks:
+        print("lost updates found without locks" if not ok else "no lost update provoked: raise --threads/--cycles")
+        ok = not ok
+    else:
+        hold = 1.0
+        elapsed = other_clients_proceed(50, hold)
+        print(f"50 other clients while one lock was held for {hold}s: {elapsed:.3f}s")
+        ok = ok and elapsed < hold
+
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,9 @@ let streaming = false;
 let counting = false;
 let pollingInterval = null;
 let currentStream = null;
+let frameSocket = null;
+let framesInFlight = 0;
+const MAX_FRAMES_IN_FLIGHT = 2;
 const clientId = 'client_' + Math.random().toString(36).substr(2, 9);
 let sessionData = {
     startTime: null,
@@ -367,6 +370,7 @@ function stopCamera() {
         clearInterval(pollingInterval);
         pollingInterval = null;
     }
+    closeFrameSocket();
     
     updateStatus('Camera stopped', false);
     startCameraBtn.innerHTML = '<i class="fas fa-video"></i> Start Camera';
@@ -401,6 +405,7 @@ function toggleCounting() {
         };
         
         // Start counting
+        openFrameSocket();
         pollingInterval = setInterval(processFrame, 500);
         toggleCountingBtn.innerHTML = '<i class="fas fa-pause"></i> Stop Counting';
         toggleCountingBtn.classList.remove('btn-secondary');
@@ -413,6 +418,7 @@ function toggleCounting() {
             clearInterval(pollingInterval);
             pollingInterval = null;
         }
+        closeFrameSocket();
         toggleCountingBtn.innerHTML = '<i class="fas fa-play"></i> Start Counting';
         toggleCountingBtn.classList.remove('btn-primary');
         toggleCountingBtn.classList.add('btn-secondary');
@@ -432,39 +438,37 @@ function captureFrame() {
     ctx.drawImage(video, -canvas.width, 0, canvas.width, canvas.height);
     ctx.restore();
     
-    return canvas.toDataURL('image/jpeg', 0.8);
+    // Raw JPEG bytes - no base64 string on the wire
+    return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.8));
 }
 
 async function processFrame() {
     if (!streaming || !counting) return;
     
-    const frame = captureFrame();
+    // Backpressure: don't capture while the stream already has frames queued
+    if (frameSocket && frameSocket.readyState === WebSocket.OPEN &&
+        framesInFlight >= MAX_FRAMES_IN_FLIGHT) return;
+    
+    const frame = await captureFrame();
     if (!frame) return;
     
+    if (frameSocket && frameSocket.readyState === WebSocket.OPEN) {
+        framesInFlight++;
+        frameSocket.send(frame);
+        return;
+    }
+    
     try {
         const response = await fetch('/api/predict', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ 
-                image: frame, 
-                client_id: clientId,
-                timestamp: Date.now()
-            })
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'X-Client-Id': clientId
+            },
+            body: frame
         });
         
-        const data = await response.json();
-        
-        if (data.ok) {
-            updateSquatDisplay(data);
-            updateSessionData(data);
-            
-            // Live overlay updates
-            document.getElementById('liveKneeAngle').textContent = data.knee_angle + '°';
-            document.getElementById('liveSymmetry').textContent = data.symmetry_score + '%';
-            
-        } else {
-            handleSquatError(data);
-        }
+        handleSquatResult(await response.json());
         
     } catch (error) {
         console.error('Processing error:', error);
@@ -472,6 +476,53 @@ async function processFrame() {
     }
 }
 
+function handleSquatResult(data) {
+    if (data.ok) {
+        updateSquatDisplay(data);
+        updateSessionData(data);
+        
+        // Live overlay updates
+        document.getElementById('liveKneeAngle').textContent = data.knee_angle + '°';
+        document.getElementById('liveSymmetry').textContent = data.symmetry_score + '%';
+        
+    } else {
+        handleSquatError(data);
+    }
+}
+
+// ===== FRAME STREAM (WebSocket, falls back to HTTP) =====
+function openFrameSocket() {
+    if (!('WebSocket' in window) || frameSocket) return;
+    
+    const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const ws = new WebSocket(`${protocol}//${location.host}/ws/predict?client_id=${encodeURIComponent(clientId)}`);
+    
+    ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        // One reply covers this frame plus any the server dropped in its favour
+        framesInFlight = Math.max(0, framesInFlight - 1 - (data.dropped || 0));
+        if (counting) handleSquatResult(data);
+    };
+    
+    ws.onclose = () => {
+        if (frameSocket === ws) {
+            frameSocket = null;
+            framesInFlight = 0;
+        }
+    };
+    
+    frameSocket = ws;
+    framesInFlight = 0;
+}
+
+function closeFrameSocket() {
+    if (frameSocket) {
+        frameSocket.close();
+        frameSocket = null;
+    }
+    framesInFlight = 0;
+}
+
 function updateSquatDisplay(data) {
     // Update main displays
     repsDisplay.textContent = data.reps || 0;
@@ -621,21 +672,16 @@ function generateDietPlan() {
     // Map activity level
     const activityMap = ['sedentary', 'light', 'moderate', 'active', 'very_active'];
     
-    fetch('/api/diet_recommendation', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-            client_id: clientId,
-            weight: weight,
-            height: height,
-            age: age,
-            gender: gender,
-            goal: goal,
-            dietary_preference: dietaryPreference,
-            activity_level: activityMap[activityLevel - 1] || 'moderate'
-        })
+    postCached('/api/diet_recommendation', {
+        client_id: clientId,
+        weight: weight,
+        height: height,
+        age: age,
+        gender: gender,
+        goal: goal,
+        dietary_preference: dietaryPreference,
+        activity_level: activityMap[activityLevel - 1] || 'moderate'
     })
-    .then(response => response.json())
     .then(data => {
         updateDietDisplay(data);
         showToast('Diet plan generated successfully!', 'success');
@@ -1081,18 +1127,13 @@ function findGyms() {
     const features = Array.from(document.querySelectorAll('input[name="features"]:checked'))
         .map(input => input.value);
     
-    fetch('/api/gym_recommendations', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-            client_id: clientId,
-            location: location,
-            radius: radius,
-            budget: budget,
-            features: features
-        })
+    postCached('/api/gym_recommendations', {
+        client_id: clientId,
+        location: location,
+        radius: radius,
+        budget: budget,
+        features: features
     })
-    .then(response => response.json())
     .then(data => {
         updateGymDisplay(data);
         showToast('Found ' + data.recommended_gyms.length + ' gyms near you', 'success');
@@ -1200,6 +1241,26 @@ function generateWorkout() {
 }
 
 // ===== UTILITY FUNCTIONS =====
+// Last ETag and body per cached route. Browsers don't revalidate POSTs, so
+// the ETag is sent back by hand and an empty 304 reuses the stored body
+const cachedResults = {};
+
+function postCached(url, payload) {
+    const cached = cachedResults[url];
+    const headers = { 'Content-Type': 'application/json' };
+    if (cached) headers['If-None-Match'] = cached.etag;
+    
+    return fetch(url, { method: 'POST', headers: headers, body: JSON.stringify(payload) })
+        .then(response => {
+            if (response.status === 304 && cached) return cached.data;
+            return response.json().then(data => {
+                const etag = response.headers.get('ETag');
+                if (response.ok && etag) cachedResults[url] = { etag: etag, data: data };
+                return data;
+            });
+        });
+}
+
 function updateStatus(message, isActive) {
     statusText.textContent = message;
     statusDot.className = 'status-dot';
@@ -0,0 +1,200 @@
+# video_analysis.py - OFFLINE WORKOUT VIDEO ANALYSIS
+"""Count reps in a recorded workout video and write one record per rep.
+
+The video is split into chunks of frames that worker processes decode and
+run pose on in parallel. Workers only return compact per-frame features
+(joint angles, joint visibility, back angle), and the rep state machine
+then runs over those features in frame order, so reps that straddle a
+chunk boundary are counted exactly once.
+
+    python video_analysis.py session.mp4 -o reps.csv
+    python video_analysis.py session.mp4 --format ndjson --exercise lunge --stride 2
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import app
+
+CHUNK_SECONDS = 60
+REP_FIELDS = ["rep", "exercise", "start_s", "timestamp_s", "knee_angle", "symmetry", "rom", "score"]
+
+
+def probe(path):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise SystemExit(f"Cannot open video: {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return fps, frame_count
+
+
+def plan_chunks(frame_count, fps, chunk_seconds=CHUNK_SECONDS):
+    """[start, end) frame ranges; end None means read to the end of the file"""
+    if frame_count <= 0:
+        # Container doesn't report a length: one sequential pass
+        return [(0, None)]
+    size = max(1, int(fps * chunk_seconds))
+    return [(start, min(start + size, frame_count)) for start in range(0, frame_count, size)]
+
+
+def analyze_chunk(path, start, end, stride):
+    """Decode frames [start, end) and extract per-frame pose features.
+
+    Runs in a worker process with its own estimator. Only every `stride`-th
+    frame is decoded; the others are grabbed and skipped. Memory stays at
+    one frame plus a few dozen bytes per analyzed frame.
+    """
+    capture = cv2.VideoCapture(path)
+    if start:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    pose = app.mp.solutions.pose.Pose()
+    roi = None
+
+    frames, angles, visible, back = [], [], [], []
+    index = start
+    while end is None or index < end:
+        if (index - start) % stride:
+            if not capture.grab():
+                break
+            index += 1
+            continue
+        ok, img = capture.read()
+        if not ok:
+            break
+
+        h, w = img.shape[:2]
+        landmarks = app.run_pose(pose, img, roi) if roi is not None else None
+        if landmarks is None:
+            landmarks = app.run_pose(pose, img)
+        roi = None if landmarks is None else app.roi_from_landmarks(landmarks, w, h, roi)
+
+        if landmarks is not None:
+            frames.append(index)
+            angles.append(app.joint_angles(landmarks, w, h))
+            visible.append(app.joint_visibility(landmarks))
+            back.append(app.back_angle_of(landmarks, w, h))
+        index += 1
+
+    capture.release()
+    pose.close()
+    n_joints = len(app.JOINT_TRIPLETS)
+    return {
+        "frames": np.array(frames, dtype=np.int64),
+        "angles": np.array(angles, dtype=np.float32).reshape(-1, n_joints),
+        "visible": np.array(visible, dtype=bool).reshape(-1, n_joints),
+        "back": np.array(back, dtype=np.float32)
+    }
+
+
+class RepTracker:
+    """Runs the live rep engine over per-frame features in frame order.
+
+    A rep record uses the deepest point of the rep: its angle, symmetry
+    and back angle feed the same performance score the live counter uses.
+    """
+
+    def __init__(self, exercise, fps):
+        self.exercise = exercise
+        self.index = app.EXERCISE_INDEX[exercise]
+        self.target = app.EXERCISES[exercise]["target"]
+        self.fps = fps
+        self.state = app.new_rep_state()
+        # Reps that start by going below a threshold bottom out at the minimum angle
+        ex = app.EXERCISES[exercise]
+        self.bottom_is_min = ex["transitions"][ex["start"]][0] == "below"
+        self._reset_rep()
+
+    def _reset_rep(self):
+        self.rep_start = None
+        self.bottom = None  # (angle, symmetry, back angle)
+
+    def feed(self, chunk):
+        i = self.index
+        for frame, angles, visible, back in zip(chunk["frames"], chunk["angles"], chunk["visible"], chunk["back"]):
+            result = app.evaluate_exercises(angles.astype(np.float64), visible, self.state)
+            if not result["visible"][i].any():
+                continue
+
+            frame = int(frame)
+            metric = float(result["metric"][i])
+            if self.rep_start is None:
+                self.rep_start = frame
+            if self.bottom is None or self._deeper(metric, self.bottom[0]):
+                self.bottom = (metric, float(result["symmetry"][i]), float(back))
+
+            if result["rep_completed"][i]:
+                yield self._record(frame, float(result["rom"][i]))
+                self._reset_rep()
+
+    def _deeper(self, metric, bottom):
+        return metric < bottom if self.bottom_is_min else metric > bottom
+
+    def _record(self, frame, rom):
+        angle, symmetry, back = self.bottom
+        return {
+            "rep": int(self.state["reps"][self.index]),
+            "exercise": self.exercise,
+            "start_s": round(self.rep_start / self.fps, 2),
+            "timestamp_s": round(frame / self.fps, 2),
+            "knee_angle": round(angle, 1),
+            "symmetry": round(symmetry * 100),
+            "rom": round(rom * 100),
+            "score": app.calculate_performance_score(angle, back, symmetry, rom, target_angle=self.target)
+        }
+
+
+def analyze_video(path, exercise="squat", workers=None, stride=1, chunk_seconds=CHUNK_SECONDS):
+    """Yield per-rep records for a video file"""
+    fps, frame_count = probe(path)
+    chunks = plan_chunks(frame_count, fps, chunk_seconds)
+    tracker = RepTracker(exercise, fps)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        # map() hands results back in chunk order, which is what stitching needs
+        results = pool.map(analyze_chunk, [path] * len(chunks), *zip(*chunks), [stride] * len(chunks))
+        for chunk in results:
+            yield from tracker.feed(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count reps in a recorded workout video")
+    parser.add_argument("video")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default=None,
+                        help="default: from the output extension, else csv")
+    parser.add_argument("--exercise", default="squat", choices=sorted(app.EXERCISE_INDEX))
+    parser.add_argument("--workers", type=int, default=None, help="decode processes (default: CPU cores)")
+    parser.add_argument("--stride", type=int, default=1, help="analyze every Nth frame")
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS)
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.output and args.output.endswith((".ndjson", ".jsonl")) else "csv")
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    writer = csv.DictWriter(out, fieldnames=REP_FIELDS) if fmt == "csv" else None
+    if writer:
+        writer.writeheader()
+
+    reps = 0
+    try:
+        for record in analyze_video(args.video, args.exercise, args.workers, max(1, args.stride), args.chunk_seconds):
+            if writer:
+                writer.writerow(record)
+            else:
+                out.write(json.dumps(record) + "\n")
+            reps += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"✅ {reps} {args.exercise} reps found in {args.video}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()